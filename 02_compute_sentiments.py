@@ -1,25 +1,34 @@
 ###
 #
 # This script loops through all comments for every guest and computes the compound
-# sentiment score using the VADER implementation in nltk. It adds the sentiment score
-# of each comment to the comments JSON file and it adds some basic aggregate metrics
-# to the guest list CSV file for each guest.
+# sentiment score using the VADER implementation in nltk. It saves the sentiment score
+# of each comment in a sidecar score file (see score_store.py) and it adds some basic
+# aggregate metrics to the guest list CSV file for each guest. Comments that already have
+# a score (by comment ID) aren't scored again.
+#
+# If the scoring server is running (see scoring_server.py) the scores are computed there,
+# which skips loading nltk and the VADER lexicon.
+#
+# By default the scores are computed with the batch VADER engine in batch_vader.py, which
+# gives the same compound scores as nltk but is a lot faster. Set sentiment_engine = 'nltk'
+# to use nltk's SentimentIntensityAnalyzer directly.
 #
 ###
 
 import json
 import os
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
 import numpy as np
+import score_store  # score_store.py file
+import scoring_server  # scoring_server.py file
 import utils  # utils.py file
 
 
+## Parameters
+sentiment_engine = 'batch'  # 'batch' or 'nltk'
+
 # read the CSV
 guest_df = utils.load_guest_list_file()
 
-# initialize sentiment analyzer
-sia = SentimentIntensityAnalyzer()
-
 for i, row in guest_df.iterrows():
 
     # don't do anything if there's no video ID or the comments haven't been scraped
@@ -32,19 +41,19 @@ for i, row in guest_df.iterrows():
     comments = json.load(open(comment_file, 'r'))
     n_comments = len(comments)
 
-    scores = []
-
-    # loop through comments and get sentiment scores
-    for comment in comments:
-
-        # if comment has text, calculate sentiment score, add to JSON, and append to scores list
-        if 'commentText' in comment:
-            score = sia.polarity_scores(comment['commentText'])['compound']
-            comment['sentiment_score'] = score
-            scores.append(score)
-
-    # write the JSON file to save the sentiment scores
-    json.dump(comments, open(comment_file, 'w'), indent=2)
+    # calculate sentiment scores for the comments with text that haven't been scored yet in one batch and save them
+    scores_df = score_store.load_scores(video_id, 'sentiment')
+    ids = score_store.comment_ids(comments)
+    text_comments = [j for j, comment in enumerate(comments) if 'commentText' in comment]
+    new_comments = [j for j in text_comments if ids[j] not in scores_df.index]
+    if new_comments:
+        new_scores = scoring_server.sentiment_scores([comments[j]['commentText'] for j in new_comments],
+                                                     engine=sentiment_engine)
+        score_store.append_scores(video_id, 'sentiment', [ids[j] for j in new_comments],
+                                  {'sentiment_score': new_scores})
+        score_store.compact_scores(video_id, 'sentiment')
+
+    scores = score_store.get_comment_scores(video_id, 'sentiment', comments)['sentiment_score'].values[text_comments]
 
     # compute basic stats about score distribution
     mean_score = np.mean(scores)
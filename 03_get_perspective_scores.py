@@ -2,8 +2,10 @@
 #
 # This script loops through all comments for every guest and computes toxicity and
 # severe toxicity scores for each comment using the Google Perspective API. It adds
-# the scores to the comments JSON file and it adds some basic aggregate metrics
-# to the guest list CSV file for each guest.
+# the scores to a sidecar score file for each video (see score_store.py) and it adds some
+# basic aggregate metrics to the guest list CSV file for each guest. Comments that already
+# have scores (by comment ID) aren't scored again, so rescraping a video only means
+# scoring its new comments.
 #
 # This script takes a long time to run because the API has an hourly usage limit. I
 # alleviated that issue a bit by creating 20 different API keys and rotating through
@@ -11,157 +13,214 @@
 # The script should be fairly robust about picking up where it left off if it gets
 # interrupted and needs to be run again.
 #
+# If score_near_duplicates_once is True, only one comment in each cluster of near-duplicate
+# comments (see near_duplicates.py) is sent to the API and its scores are copied to the
+# rest of the cluster. This saves API calls, but the copied scores are estimates, so the
+# guest means can differ slightly from the published ones. It's off by default.
+#
+# If sampling_mode is True, comments are scored in a random order for each guest and
+# scoring stops once the confidence intervals of the guest's mean toxicity and severe
+# toxicity are narrower than sampling_tolerance. The guest means are then computed from
+# the sample, and the sample size and confidence intervals are added to the CSV file.
+# The random order only depends on the video ID and sampling_seed, so an interrupted run
+# picks up the same sample where it left off.
+#
 ###
 
 import json
 import os
+import zlib
 import numpy as np
-from googleapiclient import discovery
-from googleapiclient.errors import HttpError
+from scipy import stats
 import time
-import sys
+import near_duplicates  # near_duplicates.py file
+import perspective  # perspective.py file
+import score_store  # score_store.py file
 import utils  # utils.py file
 
 
 ## Parameters
 verbose = True
+score_near_duplicates_once = False  # only score one comment from each near-duplicate cluster (changes the guest means)
+sampling_mode = False  # True to score a random sample of each guest's comments instead of all of them
+sampling_tolerance = 0.02  # stop sampling when the confidence intervals are narrower than this
+sampling_confidence = 0.95
+sampling_min_comments = 100  # always score at least this many comments per guest
+sampling_seed = 0
 
 # read the CSV
 guest_df = utils.load_guest_list_file()
 
-# set up Perspective API
-# the text file has multiple API keys (from multiple projects) so they can hopefully all be used to speed up the process
-api_service_name = 'commentanalyzer'
-api_version = 'v1alpha1'
-api_keys = open(utils.perspective_api_key_file).read().split()
-api_list = [discovery.build(api_service_name, api_version, developerKey=key) for key in api_keys]
+# set up Perspective API (one service for each API key)
+api_list = perspective.build_apis()
 
 # specify that we'll start by using teh first API key
 which_api = 0
 
+# load the near-duplicate clusters (or find them if that hasn't been done yet)
+cluster_df = None
+if score_near_duplicates_once:
+    if os.path.isfile(utils.near_duplicate_file):
+        cluster_df = near_duplicates.load_clusters()
+    else:
+        cluster_df = near_duplicates.find_clusters(guest_df, verbose=verbose)
+        near_duplicates.save_clusters(cluster_df)
+    if verbose:
+        near_duplicates.report_savings(cluster_df)
 
-def compute_perspective_scores(apis, comment_text, which_api=0, retry_rate=0.5, max_tries=0, current_tries=1,
-                               verbose=False):
-    """
-    Compute toxicity and severe toxicity scores of a comment using Google's Perspective API.
-
-    :param apis: list of Perspective API services set up using different API keys
-    :param comment_text: comment text (string)
-    :param which_api: index of of the API service that will be used from apis
-    :param retry_rate: how long to wait before making another API call if it fails
-    :param max_tries: maximum times to retry (set to 0 for no maximum)
-    :param current_tries: the current attempt number
-    :param verbose: if True, print some status messages
-
-    :return: toxicity score, severe toxicity score, and which API number was used
-    """
-
-    # if we've tried too many times, quit and print a message
-    if current_tries > max_tries > 0:
-        sys.exit(f'Maximum tries ({max_tries}) exceeded without success.')
-
-    # select the API out of the list
-    if not isinstance(apis, list):
-        apis = [apis]
-    api = apis[which_api]
-
-    # attempt to get scores from Perspective API; if quota is exceeded, wait and try again with the next API
-    try:
+# scores of each near-duplicate cluster that has been scored so far (shared across videos)
+cluster_scores = {}
 
-        # max comment length is 20480 -- truncate if it's that long
-        if len(comment_text) > 20480:
-            comment_text = comment_text[:20479]
 
-        analyze_request = {
-            'comment': {'text': comment_text},
-            'requestedAttributes': {'TOXICITY': {}, 'SEVERE_TOXICITY': {}},
-            'languages': ['en']
-        }
+class RunningConfidenceInterval:
+    """
+    Keep track of the mean and variance of a sample as values are added (using Welford's algorithm) and compute a
+    confidence interval for the population mean. The sample is assumed to be drawn without replacement from a finite
+    population, so the interval includes the finite population correction.
+    """
+    def __init__(self, population_size, confidence=0.95):
+        """
+        :param population_size: number of items in the population (e.g., comments with text)
+        :param confidence: confidence level of the interval
+        """
+        self.population_size = population_size
+        self.confidence = confidence
+        self.n = 0
+        self.mean = 0.0
+        self.sum_sq = 0.0
+
+    def add(self, value):
+        """
+        Add a value to the sample (NaN values are ignored).
+        """
+        if value is None or np.isnan(value):
+            return
+        self.n += 1
+        delta = value - self.mean
+        self.mean += delta / self.n
+        self.sum_sq += delta * (value - self.mean)
+
+    def variance(self):
+        return self.sum_sq / (self.n - 1) if self.n > 1 else np.nan
+
+    def interval(self):
+        """
+        :return: lower and upper bounds of the confidence interval (NaN if there are fewer than two values)
+        """
+        if self.n < 2:
+            return np.nan, np.nan
+
+        fpc = np.sqrt(max(self.population_size - self.n, 0) / max(self.population_size - 1, 1))
+        half_width = stats.t.ppf(0.5 + self.confidence / 2, self.n - 1) * np.sqrt(self.variance() / self.n) * fpc
+        return self.mean - half_width, self.mean + half_width
+
+    def width(self):
+        low, high = self.interval()
+        return high - low
+
+
+def sample_order(video_id, n, seed=0):
+    """
+    Random order for scoring the comments of a video in sampling mode. The order only depends on the video ID and the
+    seed, so it's the same every time the script runs.
+    """
+    rng = np.random.RandomState((seed + zlib.crc32(video_id.encode('utf-8'))) % 2 ** 32)
+    return rng.permutation(n)
 
-        response = api.comments().analyze(body=analyze_request).execute()
 
-        tox_score = response['attributeScores']['TOXICITY']['summaryScore']['value']
-        sev_tox_score = response['attributeScores']['SEVERE_TOXICITY']['summaryScore']['value']
+def add_perspective_scores(video_id, comments, which_api=0, comments_per_write=50, clusters=None,
+                           cluster_scores=None, sample=False, tolerance=0.02, confidence=0.95, min_comments=100, seed=0,
+                           verbose=True):
+    """
+    Compute the toxicity and severe toxicity scores of each comment of a video that doesn't have them yet and add them
+    to the video's score file. This function might take a very long time to process all comments, so new scores are
+    appended to the score file periodically to avoid losing progress if it crashes.
 
-        # return the toxicity score, severe toxicity score, and which API key was used
-        return tox_score, sev_tox_score, which_api
+    If near-duplicate clusters are given, a comment is only sent to the API if no other comment in its cluster has been
+    scored yet -- otherwise the scores of the cluster are copied.
 
-    except HttpError as e:
-        # long comments are already handled above, but sometimes this error is thrown for comments w/ no
-        # readable characters -- skip those
-        if 'Comment text too long' in e._get_reason():
-            return np.nan, np.nan, which_api
+    :param video_id: YouTube video ID
+    :param comments: list of comment dictionaries from the video's comment file
+    :param which_api: which API from the list to use first
+    :param comments_per_write: number of comments to process before writing the new scores
+    :param clusters: cluster ID of each comment in the file, in order, with None for comments that aren't in a cluster
+    (see near_duplicates.get_video_clusters) -- None to score every comment
+    :param cluster_scores: dictionary of cluster ID -> (toxicity, severe toxicity) for clusters that have been scored;
+    updated as comments are scored
+    :param sample: if True, score comments in a random order and stop when the confidence intervals of the mean
+    toxicity and severe toxicity are narrower than the tolerance
+    :param tolerance: maximum confidence interval width when sampling
+    :param confidence: confidence level of the intervals when sampling
+    :param min_comments: minimum number of comments to score when sampling
+    :param seed: random seed for the sampling order
+    :param verbose: if True, print some status messages
 
-        elif verbose and ('Quota exceeded' not in e._get_reason()):
-            print(f'\nOther HttpError -- API {which_api}: {e._get_reason()}')
+    :return: the API that was used last (so we can start with the next one for the next comment file), and a
+    dictionary with the sampled comment indices and confidence intervals (None if not sampling)
+    """
 
-        time.sleep(retry_rate)
+    # get the scores that have already been computed (comment ID -> (toxicity, severe toxicity))
+    ids = score_store.comment_ids(comments)
+    scores_df = score_store.load_scores(video_id, 'perspective')
+    scores = dict(zip(scores_df.index, zip(scores_df['perspective_toxicity'],
+                                           scores_df['perspective_severe_toxicity'])))
+    new_ids = []
 
-        # retry using the next entry in the API list
-        next_api = (which_api + 1) % len(apis)
+    def write_new_scores():
+        score_store.append_scores(video_id, 'perspective', new_ids, {
+            'perspective_toxicity': [scores[comment_id][0] for comment_id in new_ids],
+            'perspective_severe_toxicity': [scores[comment_id][1] for comment_id in new_ids]})
+        new_ids.clear()
 
-        return compute_perspective_scores(apis=apis, comment_text=comment_text, which_api=next_api,
-                                          retry_rate=retry_rate, max_tries=max_tries, current_tries=current_tries+1,
-                                          verbose=verbose)
+    n_without_scores = sum([('commentText' in comment) and (ids[j] not in scores)
+                            for j, comment in enumerate(comments)])
 
-    # also handle ConnectionResetError -- try again with same API without counting the try
-    except ConnectionResetError as e:
-        time.sleep(retry_rate)
+    if cluster_scores is None:
+        cluster_scores = {}
 
-        if verbose:
-            print(f'Handled connection reset error -- API key {which_api}')
+    if verbose:
+        print(f'{len(comments)} ({n_without_scores} without scores)', flush=True)
 
-        return compute_perspective_scores(apis=apis, comment_text=comment_text, which_api=which_api,
-                                          retry_rate=retry_rate, max_tries=max_tries, current_tries=current_tries,
-                                          verbose=verbose)
+    i = 0
+    n_copied = 0
 
+    # in sampling mode, go through the comments in a fixed random order and keep track of the confidence intervals
+    if sample:
+        order = sample_order(video_id, len(comments), seed)
+        n_text = sum(['commentText' in comment for comment in comments])
+        tox_ci = RunningConfidenceInterval(n_text, confidence)
+        sev_tox_ci = RunningConfidenceInterval(n_text, confidence)
+        sampled = []
+    else:
+        order = range(len(comments))
 
-def add_perspective_scores_to_json(file, which_api=0, comments_per_write=50, verbose=True):
-    """
-    Add keys for each comment in the JSON file with the toxicity and severe toxicity scores. This function might take a
-    very long time to process all comments, so the JSON file is written periodically to avoid losing progress if it
-    crashes.
+    for j in order:
+        comment = comments[j]
 
-    :param file: comment file path
-    :param which_api: which API from the list to use first
-    :param comments_per_write: number of comments to process before writing file.
-    :param verbose: if True, print some status messages
-
-    :return: the API that was used last (so we can start with the next one for the next comment file)
-    """
+        # get scores from Perspective API if the comment has text and we haven't already computed the scores
+        if 'commentText' in comment:
+            cluster = clusters[j] if clusters is not None else None
 
-    # get comments by reading the JSON file for the video ID
-    comments = json.load(open(file, 'r'))
+            if ids[j] not in scores:
 
-    n_without_scores = sum([('commentText' in comment) and ('perspective_toxicity' not in comment)
-                            for comment in comments])
+                # copy the scores if another comment in the near-duplicate cluster already has them
+                if cluster is not None and cluster in cluster_scores:
+                    scores[ids[j]] = cluster_scores[cluster]
+                    n_copied += 1
 
-    if verbose:
-        print(f'{len(comments)} ({n_without_scores} without scores)', flush=True)
+                else:
+                    tox_score, sev_tox_score, which_api = perspective.compute_perspective_scores(
+                        apis=api_list, comment_text=comment['commentText'], which_api=which_api, verbose=verbose)
+                    scores[ids[j]] = (tox_score, sev_tox_score)
 
-    i = 0
+                    # increment the counter
+                    i += 1
 
-    for comment in comments:
+                new_ids.append(ids[j])
 
-        # get scores from Perspective API if the comment has text and we haven't already computed the scores
-        if 'commentText' in comment:
-            if ('perspective_toxicity' not in comment) \
-                    or (comment['perspective_toxicity'] == np.nan) \
-                    or ('perspective_severe_toxicity' not in comment) \
-                    or (comment['perspective_severe_toxicity'] == np.nan):
-
-                tox_score, sev_tox_score, which_api = compute_perspective_scores(apis=api_list,
-                                                                                 comment_text=comment['commentText'],
-                                                                                 which_api=which_api,
-                                                                                 verbose=verbose)
-                comment['perspective_toxicity'] = tox_score
-                comment['perspective_severe_toxicity'] = sev_tox_score
-
-                # increment the counter
-                i += 1
-        else:
-            comment['perspective_toxicity'] = np.nan
-            comment['perspective_severe_toxicity'] = np.nan
+            # remember the scores for the rest of the cluster
+            if cluster is not None and not np.isnan(scores[ids[j]][0]):
+                cluster_scores[cluster] = scores[ids[j]]
 
         # print progress indicators if verbose is set
         if verbose:
@@ -170,22 +229,40 @@ def add_perspective_scores_to_json(file, which_api=0, comments_per_write=50, ver
             elif i % 100 == 0 and i > 0:
                 print('.', end=' ', flush=True)
 
-        # after processing the specified number of comments, write the JSON file
-        if i % comments_per_write == 0 and i > 0:
-            json.dump(comments, open(file, 'w'), indent=2)
+        # after processing the specified number of comments, write the new scores
+        if i % comments_per_write == 0 and i > 0 and new_ids:
+            write_new_scores()
+
+        # stop sampling once the confidence intervals are narrow enough
+        if sample and 'commentText' in comment:
+            sampled.append(j)
+            tox_ci.add(scores[ids[j]][0])
+            sev_tox_ci.add(scores[ids[j]][1])
+            if len(sampled) >= min_comments and tox_ci.width() < tolerance and sev_tox_ci.width() < tolerance:
+                break
 
-    # write the JSON file after processing all comments
-    json.dump(comments, open(file, 'w'), indent=2)
+    # write the rest of the new scores after processing all comments and fold them into the score file
+    if new_ids:
+        write_new_scores()
+    score_store.compact_scores(video_id, 'perspective')
 
     if verbose and i > 0:
         print('')
+    if verbose and n_copied > 0:
+        print(f'copied scores from near duplicates for {n_copied} comments')
+
+    sample_info = None
+    if sample:
+        sample_info = {'indices': sampled, 'toxicity_ci': tox_ci.interval(), 'severe_toxicity_ci': sev_tox_ci.interval()}
+        if verbose:
+            print(f'sampled {len(sampled)} of {n_text} comments', flush=True)
 
     # return the api that was last used so we know which one to start with for the next row
-    return which_api
+    return which_api, sample_info
 
 
 # loop through guest CSV file
-#  - first, add Perspective API scores to each JSON file
+#  - first, add Perspective API scores to each score file
 #  - then calculate mean scores for each guest and save to CSV file
 for i, row in guest_df.iterrows():
 
@@ -203,34 +280,19 @@ for i, row in guest_df.iterrows():
         start = time.time()
         print(f"\nstarting {row['guest']} -- ", end='')
 
-    # get comment file add the Perspective API scores to each comment
+    # get comments and add the Perspective API scores of each comment to the score file
     video_id = row['video_id']
-    comment_file = os.path.join(utils.comment_dir, f'comments-{video_id}.json')
-    which_api = add_perspective_scores_to_json(comment_file, which_api=which_api, verbose=verbose)
-
-    # get the average Perspective API scores
-    comments = json.load(open(comment_file, 'r'))
-    mean_tox = np.nanmean([comment['perspective_toxicity'] for comment in comments])
-    mean_sev_tox = np.nanmean([comment['perspective_severe_toxicity'] for comment in comments])
-    var_tox = np.nanvar([comment['perspective_toxicity'] for comment in comments])
-    var_sev_tox = np.nanvar([comment['perspective_severe_toxicity'] for comment in comments])
-
-    # get the average scores for the first 1000 comments
-    comments_1000 = comments[-1000:]
-    mean_tox_1000 = np.nanmean([comment['perspective_toxicity'] for comment in comments_1000])
-    mean_sev_tox_1000 = np.nanmean([comment['perspective_severe_toxicity'] for comment in comments_1000])
-    var_tox_1000 = np.nanvar([comment['perspective_toxicity'] for comment in comments_1000])
-    var_sev_tox_1000 = np.nanvar([comment['perspective_severe_toxicity'] for comment in comments_1000])
-
-    # add the mean scores to the dataframe
-    guest_df.loc[i, 'mean_toxicity'] = mean_tox
-    guest_df.loc[i, 'mean_severe_toxicity'] = mean_sev_tox
-    guest_df.loc[i, 'var_toxicity'] = var_tox
-    guest_df.loc[i, 'var_severe_toxicity'] = var_sev_tox
-    guest_df.loc[i, 'mean_toxicity_1000'] = mean_tox_1000
-    guest_df.loc[i, 'mean_severe_toxicity_1000'] = mean_sev_tox_1000
-    guest_df.loc[i, 'var_toxicity_1000'] = var_tox_1000
-    guest_df.loc[i, 'var_severe_toxicity_1000'] = var_sev_tox_1000
+    comments = json.load(open(os.path.join(utils.comment_dir, f'comments-{video_id}.json'), 'r'))
+    clusters = near_duplicates.get_video_clusters(cluster_df, video_id, comments) if cluster_df is not None else None
+    which_api, sample_info = add_perspective_scores(video_id, comments, which_api=which_api, clusters=clusters,
+                                                    cluster_scores=cluster_scores, sample=sampling_mode,
+                                                    tolerance=sampling_tolerance, confidence=sampling_confidence,
+                                                    min_comments=sampling_min_comments, seed=sampling_seed,
+                                                    verbose=verbose)
+
+    # add the mean scores to the dataframe (only from the sampled comments in sampling mode)
+    scores = score_store.get_comment_scores(video_id, 'perspective', comments)
+    mean_tox, mean_sev_tox = perspective.add_guest_metrics(guest_df, i, scores, sample_info)
 
     utils.save_guest_list_file(guest_df)
 
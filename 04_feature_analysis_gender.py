@@ -5,6 +5,9 @@
 #
 # It takes a little over 30 minutes to run on the whole dataset on my MacBook Pro.
 #
+# Each comment is tokenized on its own and n-grams don't cross from one comment to the
+# next, so the counts line up with the comment index (see comment_index.py).
+#
 ###
 
 
@@ -12,8 +15,9 @@ import utils
 import nlp_utils as nlp
 import os
 import json
-from models import multinomial_dirichlet_model
-from nltk.tokenize import TweetTokenizer
+import near_duplicates
+from ngram_counter import SketchNgramCounter
+from models import multinomial_dirichlet_model, sparse_multinomial_dirichlet_model
 from sklearn.feature_extraction.text import CountVectorizer
 import numpy as np
 import random
@@ -24,9 +28,47 @@ import time
 
 ## PARAMETERS
 sample_rate = 1
-max_features = 20000
+max_features = 20000  # None to keep every token/bigram (set top_k too so the results stay a manageable size)
 scrub_names = True
 bigrams = True
+ngram_range = (1, 2)  # n-gram sizes for the second analysis, e.g. (1, 4) to include trigrams and 4-grams
+count_engine = 'sklearn'  # 'sklearn' for CountVectorizer or 'sketch' for SketchNgramCounter (uses much less memory)
+min_count = 5  # with the sketch engine, drop n-grams that appear fewer times than this
+sketch_width = None  # with the sketch engine, counters per sketch row (None to size it from the number of n-grams)
+sketch_depth = 4  # with the sketch engine, number of sketch rows
+count_clusters_once = False  # only count one comment from each near-duplicate cluster (see near_duplicates.py)
+top_k = None  # if set, use the sparse model and only keep the top_k features in each direction
+save_full_results = False  # with top_k, also write the results for every feature to a memory-mapped .npy file
+
+
+def make_vectorizer(ngram_range=(1, 1)):
+    """
+    Set up the n-gram counter for the selected count_engine. Both have the same fit_transform/get_feature_names
+    interface.
+    Documents are lists of comments.
+    """
+    if count_engine == 'sketch':
+        return SketchNgramCounter(tokenizer=mytokenizer.tokenize, ngram_range=ngram_range, max_features=max_features,
+                                  min_count=min_count, sketch_width=sketch_width, sketch_depth=sketch_depth)
+
+    # lowercase and tokenize each comment separately (CountVectorizer's own analyzer would join them into one string)
+    def analyzer(comments):
+        return nlp.comment_ngrams([mytokenizer.tokenize(comment.lower()) for comment in comments], ngram_range)
+
+    return CountVectorizer(analyzer=analyzer, max_features=max_features)
+
+
+def run_model(counts, feature_names, filename):
+    """
+    Run the Dirichlet model -- the full model if top_k is None, otherwise the sparse model that only keeps the top_k
+    features in each direction (and optionally writes every result to {filename}_all.npy).
+    """
+    if top_k is None:
+        return multinomial_dirichlet_model(counts, feature_names=feature_names)
+
+    result_file = f'{filename}_all.npy' if save_full_results else None
+    return sparse_multinomial_dirichlet_model(counts, feature_names=feature_names, top_k=top_k,
+                                              result_file=result_file)
 
 
 print(f'starting at {datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")}', flush=True)
@@ -36,15 +78,24 @@ start = time.time()
 guest_df = utils.load_guest_list_file(apply_filters=True)
 
 # set up tokenizer
-mylemmatizer = nlp.MyLemmatizer()
-tknzr = TweetTokenizer(reduce_len=True)
-mytokenizer = nlp.MyTokenizer(tokenizer=tknzr, stemmer=mylemmatizer, replace_pronouns=True)
+mytokenizer = nlp.make_feature_tokenizer(lemmatize=True, replace_pronouns=True)
+
+if count_clusters_once:
+    cluster_df = near_duplicates.load_clusters()
+    near_duplicates.report_savings(cluster_df)
 
-# put (a sample of) combined comments into a column for each guest
+# get (a sample of) the comments of each guest
+guest_comments = {}
 for i, row in guest_df.iterrows():
     video_id = row['video_id']
     comment_path = os.path.join(utils.comment_dir, f'comments-{video_id}.json')
     comments_json = json.load(open(comment_path, 'r'))
+
+    # skip comments that are near duplicates of an earlier comment
+    if count_clusters_once:
+        keep = near_duplicates.representative_mask(cluster_df, video_id, comments_json)
+        comments_json = [comment for comment, k in zip(comments_json, keep) if k]
+
     comments = [comment['commentText']
                 for comment in comments_json
                 if 'commentText' in comment]
@@ -53,49 +104,51 @@ for i, row in guest_df.iterrows():
         random.seed(0)
         comments = random.sample(comments, math.floor(len(comments) * sample_rate))
 
-    guest_df.loc[i, 'comments'] = ' '.join(comments)
+    # replace names of the guest with generic '<name>' token -- otherwise results are dominated by names
+    # note: the guest's name is only replaced in his/her comments, not in comments for other guests
+    if scrub_names:
+        names = utils.get_name_variants(row)
+        comments = [utils.scrub_text(comment, names) for comment in comments]
 
+    guest_comments[video_id] = comments
 
-# replace names of the guests with generic '<name>' token -- otherwise results are dominated by names
-# note: the guest's name is only replaced in his/her comments, not in comments for other guests
-if scrub_names:
-    guest_df = utils.scrub_names(guest_df)
 
-# group by female_flag, concatenate comments, and put into dictionary that can be passed to CountVectorizer
+# group by female_flag and put the comments of each group into a dictionary that can be passed to the n-gram counter
 grouping_col = 'female_flag'
 groups = {}
 for label in np.unique(guest_df[grouping_col]):
-    text = [row['comments'] for i, row in guest_df.iterrows() if row[grouping_col] == label]
-    groups[label] = ' '.join(text)
+    groups[label] = [comment for i, row in guest_df.iterrows() if row[grouping_col] == label
+                     for comment in guest_comments[row['video_id']]]
 
 print(f'data prep: {round(time.time() - start)} seconds', flush=True)
 
 # analyze words -- save to CSV and pickle file (CSV probably won't preserve emojis but pickle will)
 word_start = time.time()
-cv = CountVectorizer(tokenizer=mytokenizer.tokenize, max_features=max_features)
+cv = make_vectorizer()
 counts = cv.fit_transform(groups.values())
-word_df = multinomial_dirichlet_model(counts, feature_names=cv.get_feature_names())
 filename = os.path.join(utils.data_dir, f'gender_analysis_word')
 if sample_rate < 1:
     filename += f'_{round(sample_rate * 100)}pct'
+word_df = run_model(counts, cv.get_feature_names(), filename)
 word_df.to_csv(f'{filename}.csv', index=False)
 word_df.to_pickle(f'{filename}.pickle')
 
 print(f'word analysis: {round(time.time() - word_start)} seconds', flush=True)
 
-# analyze words and bigrams -- save to CSV and pickle file
+# analyze words and bigrams (or longer n-grams) -- save to CSV and pickle file
 if bigrams:
     bigram_start = time.time()
-    cv = CountVectorizer(tokenizer=mytokenizer.tokenize, max_features=max_features, ngram_range=(1,2))
+    cv = make_vectorizer(ngram_range)
     counts = cv.fit_transform(groups.values())
-    bigram_df = multinomial_dirichlet_model(counts, feature_names=cv.get_feature_names())
-    filename = os.path.join(utils.data_dir, f'gender_analysis_bigram')
+    ngram_name = 'bigram' if ngram_range[1] == 2 else f'{ngram_range[1]}gram'
+    filename = os.path.join(utils.data_dir, f'gender_analysis_{ngram_name}')
     if sample_rate < 1:
         filename += f'_{round(sample_rate * 100)}pct'
+    bigram_df = run_model(counts, cv.get_feature_names(), filename)
     bigram_df.to_csv(f'{filename}.csv', index=False)
     bigram_df.to_pickle(f'{filename}.pickle')
 
-    print(f'bigram analysis: {round(time.time() - bigram_start)} seconds', flush=True)
+    print(f'{ngram_name} analysis: {round(time.time() - bigram_start)} seconds', flush=True)
     print(f'total: {round(time.time() - start)} seconds elapsed', flush=True)
 
 print(f'finished at {datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")}')
@@ -0,0 +1,224 @@
+###
+#
+# This module builds a small "analysis cube" with everything the write-up notebook needs to
+# compare guests by gender and season without reading the comment files:
+#   - the guest-level columns of the guest list (season, female_flag, positive_ratio,
+#     mean_toxicity, ...)
+#   - for each guest and each comment-level metric (sentiment, toxicity, severe toxicity):
+#     a histogram of the comment scores and the moment sums (count, sum, sum of squares,
+#     and counts of positive, negative, and zero scores)
+#
+# Sums and histograms can be added up over any group of guests, so means, variances,
+# t-tests, and densities of the per-comment scores for any gender x season subset come
+# straight from the cube. The cube is one .npz file (one array per column).
+#
+# Build it with `python analysis_cube.py` after running the scoring scripts. Then, e.g.:
+#
+#   cube = AnalysisCube()
+#   cube.summary('toxicity', by=['female_flag', 'season'])
+#   cube.ttest('sentiment', season=lambda s: s != 1)
+#
+###
+
+import json
+import os
+import numpy as np
+import pandas as pd
+from scipy.stats import ttest_ind, ttest_ind_from_stats
+import score_store  # score_store.py file
+import utils  # utils.py file
+
+
+# metric name -> (scorer, score column, histogram bin edges)
+metrics = {
+    'sentiment': ('sentiment', 'sentiment_score', np.linspace(-1, 1, 201)),
+    'toxicity': ('perspective', 'perspective_toxicity', np.linspace(0, 1, 101)),
+    'severe_toxicity': ('perspective', 'perspective_severe_toxicity', np.linspace(0, 1, 101)),
+}
+moment_columns = ['n', 'sum', 'sum_sq', 'positive', 'negative', 'zero']
+
+
+def build_cube(guest_df, cube_file=utils.analysis_cube_file, comment_dir=utils.comment_dir,
+               score_dir=utils.score_dir, verbose=True):
+    """
+    Compute the histograms and moment sums of each guest's comment scores and write the cube file.
+
+    :param guest_df: guest dataframe (see utils.load_guest_list_file)
+    :param cube_file: path of the .npz file to write
+    :param comment_dir: directory containing the comment JSON files
+    :param score_dir: directory containing the score files (see score_store.py)
+    :param verbose: if True, print some status messages
+    """
+    guest_df = guest_df.reset_index(drop=True)
+    columns = {}
+    histograms = {metric: np.zeros((len(guest_df), len(edges) - 1), dtype=np.int64)
+                  for metric, (_, _, edges) in metrics.items()}
+    moments = {f'{metric}_{column}': np.zeros(len(guest_df)) for metric in metrics for column in moment_columns}
+
+    for i, row in guest_df.iterrows():
+        comments = json.load(open(os.path.join(comment_dir, f"comments-{row['video_id']}.json"), 'r'))
+        has_text = np.array(['commentText' in comment for comment in comments], dtype=bool)
+
+        scorer_scores = {scorer: score_store.get_comment_scores(row['video_id'], scorer, comments, score_dir)
+                         for scorer in set(scorer for scorer, _, _ in metrics.values())}
+        for metric, (scorer, column, edges) in metrics.items():
+            values = scorer_scores[scorer][column].values[has_text]
+            values = values[~np.isnan(values)]
+            histograms[metric][i] = np.histogram(values, bins=edges)[0]
+            moments[f'{metric}_n'][i] = len(values)
+            moments[f'{metric}_sum'][i] = values.sum()
+            moments[f'{metric}_sum_sq'][i] = (values ** 2).sum()
+            moments[f'{metric}_positive'][i] = (values > 0).sum()
+            moments[f'{metric}_negative'][i] = (values < 0).sum()
+            moments[f'{metric}_zero'][i] = (values == 0).sum()
+
+        if verbose:
+            print(f"added {row['guest']} -- {has_text.sum()} comments", flush=True)
+
+    # guest list columns (numeric columns as floats with NaN for missing values, everything else as strings)
+    for column in guest_df.columns:
+        try:
+            columns[f'guest__{column}'] = pd.to_numeric(guest_df[column].replace('', np.nan)).values.astype(np.float64)
+        except (ValueError, TypeError):
+            columns[f'guest__{column}'] = np.array(guest_df[column].astype(str).values, dtype=str)
+    columns.update({f'guest__{column}': values for column, values in moments.items()})
+    columns.update({f'hist__{metric}': counts for metric, counts in histograms.items()})
+    columns.update({f'edges__{metric}': edges for metric, (_, _, edges) in metrics.items()})
+
+    os.makedirs(os.path.dirname(cube_file) or '.', exist_ok=True)
+    with open(f'{cube_file}.tmp', 'wb') as f:
+        np.savez_compressed(f, **columns)
+    os.replace(f'{cube_file}.tmp', cube_file)
+
+    if verbose:
+        print(f'wrote analysis cube for {len(guest_df)} guests to {cube_file}', flush=True)
+
+
+class AnalysisCube:
+    """
+    Compute statistics for groups of guests from the cube file written by build_cube.
+
+    Guests can be selected with keyword filters on any guest column, where each filter is a value, a list of values,
+    or a function that returns True for the values to keep, e.g. female_flag=1, season=[2, 3], or
+    season=lambda s: s != 1.
+    """
+    def __init__(self, cube_file=utils.analysis_cube_file):
+        """
+        :param cube_file: path of the cube file
+        """
+        with np.load(cube_file) as data:
+            self.guests = pd.DataFrame({key[len('guest__'):]: data[key] for key in data.files
+                                        if key.startswith('guest__')})
+            self.histograms = {metric: data[f'hist__{metric}'] for metric in metrics}
+            self.edges = {metric: data[f'edges__{metric}'] for metric in metrics}
+
+    def mask(self, **filters):
+        """
+        Get a boolean array of the guests that match the filters.
+        """
+        keep = np.ones(len(self.guests), dtype=bool)
+        for column, value in filters.items():
+            values = self.guests[column]
+            if callable(value):
+                keep &= np.array([bool(value(v)) for v in values], dtype=bool)
+            elif isinstance(value, (list, tuple, set)):
+                keep &= values.isin(list(value)).values
+            else:
+                keep &= (values == value).values
+
+        return keep
+
+    def guest_values(self, column, **filters):
+        """
+        Get a guest-level column (e.g., 'positive_ratio' or 'mean_toxicity') for the guests that match the filters.
+        """
+        return self.guests.loc[self.mask(**filters), column].values
+
+    def guest_means(self, metric, **filters):
+        """
+        Get the mean comment score of each guest that matches the filters.
+        """
+        df = self.guests[self.mask(**filters)]
+        return (df[f'{metric}_sum'] / df[f'{metric}_n']).values
+
+    def moments(self, metric, **filters):
+        """
+        Compute the number of comments, mean, and standard deviation of the comment scores of the guests that match
+        the filters (pooled over all of their comments).
+
+        :return: dictionary with n, mean, std, and positive_ratio (positive / negative comments)
+        """
+        df = self.guests[self.mask(**filters)]
+        n = df[f'{metric}_n'].sum()
+        mean = df[f'{metric}_sum'].sum() / n if n > 0 else np.nan
+        var = (df[f'{metric}_sum_sq'].sum() - n * mean ** 2) / (n - 1) if n > 1 else np.nan
+        negative = df[f'{metric}_negative'].sum()
+
+        return {'n': n, 'mean': mean, 'std': np.sqrt(max(var, 0)) if n > 1 else np.nan,
+                'positive_ratio': df[f'{metric}_positive'].sum() / negative if negative > 0 else np.nan}
+
+    def summary(self, metric, by=('female_flag',), **filters):
+        """
+        Compute the comment-level moments of a metric for each group of guests.
+
+        :param metric: 'sentiment', 'toxicity', or 'severe_toxicity'
+        :param by: guest columns to group by (e.g., ['female_flag', 'season'])
+        :param filters: guest filters applied before grouping
+        :return: dataframe with one row per group: group columns, n_guests, and the moments (see moments)
+        """
+        by = list(by)
+        df = self.guests[self.mask(**filters)]
+        rows = []
+        for keys, group in df.groupby(by):
+            keys = keys if isinstance(keys, tuple) else (keys,)
+            group_filters = dict(zip(by, keys))
+            row = dict(group_filters, n_guests=len(group))
+            row.update(self.moments(metric, **group_filters, **filters))
+            rows.append(row)
+
+        return pd.DataFrame(rows)
+
+    def histogram(self, metric, **filters):
+        """
+        Add up the histograms of the comment scores of the guests that match the filters.
+
+        :return: counts and bin edges
+        """
+        return self.histograms[metric][self.mask(**filters)].sum(axis=0), self.edges[metric]
+
+    def density(self, metric, **filters):
+        """
+        Estimate the density of the comment scores of the guests that match the filters from their histograms.
+
+        :return: dataframe with the center of each bin and the density
+        """
+        counts, edges = self.histogram(metric, **filters)
+        widths = np.diff(edges)
+        return pd.DataFrame({'score': edges[:-1] + widths / 2, 'density': counts / max(counts.sum(), 1) / widths})
+
+    def ttest(self, metric, by='female_flag', groups=(0, 1), level='comment', equal_var=True, **filters):
+        """
+        Run a t-test comparing two groups of guests (by default, male vs. female guests).
+
+        :param metric: 'sentiment', 'toxicity', or 'severe_toxicity' -- or any guest column when level is 'guest'
+        :param by: guest column that defines the groups
+        :param groups: the two values of the by column to compare
+        :param level: 'comment' to compare the scores of all comments (computed from the moment sums) or 'guest' to
+        compare guest-level values (each guest's mean comment score, or the guest column itself)
+        :param equal_var: if True, run a standard t-test; otherwise run Welch's t-test
+        :param filters: guest filters applied to both groups
+        :return: scipy t-test result
+        """
+        if level == 'comment':
+            a, b = [self.moments(metric, **{by: group}, **filters) for group in groups]
+            return ttest_ind_from_stats(a['mean'], a['std'], a['n'], b['mean'], b['std'], b['n'], equal_var=equal_var)
+
+        if metric in metrics:
+            a, b = [self.guest_means(metric, **{by: group}, **filters) for group in groups]
+        else:
+            a, b = [self.guest_values(metric, **{by: group}, **filters) for group in groups]
+        return ttest_ind(a, b, equal_var=equal_var, nan_policy='omit')
+
+
+if __name__ == '__main__':
+    build_cube(utils.load_guest_list_file(apply_filters=True))
@@ -0,0 +1,344 @@
+import numpy as np
+
+
+class BatchSentimentAnalyzer:
+    """
+    Compute VADER compound sentiment scores for many comments at once.
+
+    SentimentIntensityAnalyzer.polarity_scores processes one string at a time in pure Python. This class gives the same
+    compound scores, but it splits all of the comments into one long array of token IDs and applies the VADER rules
+    (ALL CAPS emphasis, boosters/dampeners, negation, "least", idioms, "but", and punctuation emphasis) to the whole
+    array with numpy. Every token the rules look at (lexicon words, boosters, negations, and the words in special rules
+    and idioms) is compiled into token ID arrays up front. Other tokens all share one of two IDs (one for words with
+    "n't" and one for everything else), so the arrays never change after they're built and memory doesn't grow with the
+    number of distinct words scored.
+
+    The rules follow the nltk implementation exactly, including its quirks -- e.g., a word that appears more than once
+    in a comment gets the score of its first appearance every time.
+    """
+    def __init__(self, sia=None):
+        """
+        :param sia: nltk SentimentIntensityAnalyzer to take the lexicon and constants from (loads the default VADER
+        lexicon if None)
+        """
+        if sia is None:
+            from nltk.sentiment.vader import SentimentIntensityAnalyzer
+            sia = SentimentIntensityAnalyzer()
+
+        self.sia = sia
+        self.constants = sia.constants
+        self.punc_list = list(self.constants.PUNC_LIST)
+        self.remove_punctuation = self.constants.REGEX_REMOVE_PUNCTUATION
+
+        # token ID arrays -- lexicon words get the first IDs, then the other words used by the rules
+        self.vocab = {}
+        self.n_ids = 0
+        self.valence = np.zeros(0)
+        self.in_lexicon = np.zeros(0, dtype=bool)
+        self.booster = np.zeros(0)
+        self.negation = np.zeros(0, dtype=bool)
+
+        # cache of raw token -> (lowercase token ID, token is ALL CAPS, token is already lowercase), cleared when it has
+        # max_cache_size entries
+        self.token_cache = {}
+        self.max_cache_size = 1000000
+
+        for word in sia.lexicon:
+            self.get_id(word)
+        for word in list(self.constants.NEGATE) + list(self.constants.BOOSTER_DICT):
+            self.get_id(word)
+
+        # IDs of words with special rules (these all compare lowercase versions of the tokens)
+        self.special_ids = {word: self.get_id(word)
+                            for word in ['kind', 'of', 'least', 'at', 'very', 'but', 'never', 'so', 'this']}
+
+        # multi-word idioms and boosters as tuples of token IDs
+        self.idioms = [(tuple(self.get_id(w) for w in idiom.split()), value)
+                       for idiom, value in self.constants.SPECIAL_CASE_IDIOMS.items()]
+        self.booster_bigrams = [tuple(self.get_id(w) for w in phrase.split())
+                                for phrase in self.constants.BOOSTER_DICT if len(phrase.split()) == 2]
+
+        # shared IDs for words that aren't used by any rule (they only differ in whether they're negations)
+        self.other_id = self.get_id('')
+        self.other_negation_id = self.get_id("n't")
+
+    def lookup_id(self, word):
+        """
+        Get the ID of a lowercase token without adding it (tokens that aren't used by any rule get a shared ID).
+        """
+        token_id = self.vocab.get(word)
+        if token_id is None:
+            token_id = self.other_negation_id if "n't" in word else self.other_id
+
+        return token_id
+
+    def get_id(self, word):
+        """
+        Get the ID of a lowercase token, adding it to the ID arrays if it's new.
+        """
+        if word in self.vocab:
+            return self.vocab[word]
+
+        token_id = self.n_ids
+        self.vocab[word] = token_id
+        self.n_ids += 1
+
+        if token_id >= len(self.valence):
+            capacity = max(1024, 2 * len(self.valence))
+            self.valence = np.resize(self.valence, capacity)
+            self.in_lexicon = np.resize(self.in_lexicon, capacity)
+            self.booster = np.resize(self.booster, capacity)
+            self.negation = np.resize(self.negation, capacity)
+
+        self.in_lexicon[token_id] = word in self.sia.lexicon
+        self.valence[token_id] = self.sia.lexicon.get(word, 0.0)
+        self.booster[token_id] = self.constants.BOOSTER_DICT.get(word, 0.0)
+        self.negation[token_id] = (word in self.constants.NEGATE) or ("n't" in word)
+
+        return token_id
+
+    def split_words(self, text):
+        """
+        Split a string into words the same way nltk's SentiText does: split on whitespace, drop single characters, and
+        strip a single leading or trailing punctuation mark (from the VADER punctuation list) from words.
+        """
+        words_only = {w for w in self.remove_punctuation.sub('', text).split() if len(w) > 1}
+        words = []
+        for word in text.split():
+            if len(word) <= 1:
+                continue
+            if not word[0].isalnum() or not word[-1].isalnum():
+                for punc in self.punc_list:
+                    if word.endswith(punc) and word[:-len(punc)] in words_only:
+                        word = word[:-len(punc)]
+                        break
+                    if word.startswith(punc) and word[len(punc):] in words_only:
+                        word = word[len(punc):]
+                        break
+            words.append(word)
+
+        return words
+
+    def tokenize_batch(self, texts):
+        """
+        Convert a list of strings into flat arrays with one entry per word (across all of the strings).
+
+        :param texts: list of strings
+        :return: dictionary of numpy arrays (words of each string are in order, one string after the other)
+        """
+        lower_ids, is_upper, is_lower, first_index, comment_ids, positions, lengths = [], [], [], [], [], [], []
+        is_cap_diff = np.zeros(len(texts), dtype=bool)
+        offset = 0
+
+        for c, text in enumerate(texts):
+            words = self.split_words(text)
+            n = len(words)
+
+            n_upper = 0
+            first = {}
+            for j, word in enumerate(words):
+                if word not in self.token_cache:
+                    if len(self.token_cache) >= self.max_cache_size:
+                        self.token_cache = {}
+                    lower = word.lower()
+                    self.token_cache[word] = (self.lookup_id(lower), word.isupper(), word == lower)
+                token_id, upper, lower = self.token_cache[word]
+                lower_ids.append(token_id)
+                is_upper.append(upper)
+                is_lower.append(lower)
+                n_upper += upper
+                first_index.append(offset + first.setdefault(word, j))
+
+            is_cap_diff[c] = 0 < n - n_upper < n
+            comment_ids += [c] * n
+            positions += range(n)
+            lengths.append(n)
+            offset += n
+
+        lengths = np.array(lengths, dtype=np.int64)
+        comment_ids = np.array(comment_ids, dtype=np.int64)
+
+        return {
+            'lower_ids': np.array(lower_ids, dtype=np.int64),
+            'is_upper': np.array(is_upper, dtype=bool),
+            'is_lower': np.array(is_lower, dtype=bool),
+            'first_index': np.array(first_index, dtype=np.int64),
+            'comment_ids': comment_ids,
+            'positions': np.array(positions, dtype=np.int64),
+            'lengths': lengths,
+            'is_cap_diff': is_cap_diff[comment_ids],
+        }
+
+    def compound_scores(self, texts):
+        """
+        Compute the VADER compound score for each string in a list -- the same as
+        [sia.polarity_scores(text)['compound'] for text in texts], but much faster.
+
+        :param texts: list of strings
+        :return: numpy array of compound scores
+        """
+        texts = [text if isinstance(text, str) else str(text.encode('utf-8')) for text in texts]
+        if len(texts) == 0:
+            return np.zeros(0)
+
+        batch = self.tokenize_batch(texts)
+        ids = batch['lower_ids']
+        pos = batch['positions']
+        remaining = batch['lengths'][batch['comment_ids']] - pos - 1  # number of words after each word
+        cap_diff = batch['is_cap_diff']
+        special = self.special_ids
+        n = len(ids)
+
+        def shift(values, k, fill):
+            # value of the word k positions earlier (k > 0) or later (k < 0) in the flat array
+            out = np.full(n, fill, dtype=values.dtype)
+            if 0 < k < n:
+                out[k:] = values[:-k]
+            elif 0 < -k < n:
+                out[:k] = values[-k:]
+            return out
+
+        # the 'raw' ID only matches a lowercase word when the original token was lowercase (some rules are case
+        # sensitive)
+        raw_ids = np.where(batch['is_lower'], ids, -1)
+        prev_ids = {k: shift(ids, k, -1) for k in range(1, 4)}
+        prev_raw = {k: shift(raw_ids, k, -1) for k in range(1, 4)}
+        prev_upper = {k: shift(batch['is_upper'], k, False) for k in range(1, 4)}
+
+        # valence of sentiment-laden words, with ALL CAPS emphasis
+        in_lexicon = self.in_lexicon[ids]
+        valence = np.where(in_lexicon, self.valence[ids], 0.0)
+        caps = in_lexicon & batch['is_upper'] & cap_diff
+        valence = np.where(caps, np.where(valence > 0, valence + self.constants.C_INCR,
+                                          valence - self.constants.C_INCR), valence)
+
+        # check if the preceding words increase, decrease, or negate the valence
+        for start_i in range(3):
+            k = start_i + 1
+            active = in_lexicon & (pos > start_i) & ~self.in_lexicon[np.maximum(prev_ids[k], 0)]
+
+            # boosters/dampeners (scalar_inc_dec), dampened based on distance from the current word
+            scalar = self.booster[np.maximum(prev_ids[k], 0)] * (prev_ids[k] >= 0)
+            is_booster = scalar != 0
+            scalar = np.where(valence < 0, -scalar, scalar)
+            caps = is_booster & prev_upper[k] & cap_diff
+            scalar = np.where(caps, np.where(valence > 0, scalar + self.constants.C_INCR,
+                                             scalar - self.constants.C_INCR), scalar)
+            scalar = scalar * [1, 0.95, 0.9][start_i]
+            valence = np.where(active, valence + scalar, valence)
+
+            # negation (_never_check)
+            negated = self.negation[np.maximum(prev_ids[k], 0)] & (prev_ids[k] >= 0)
+            if start_i == 0:
+                valence = np.where(active & negated, valence * self.constants.N_SCALAR, valence)
+            elif start_i == 1:
+                never_so = (prev_raw[2] == special['never']) & np.isin(prev_raw[1], [special['so'], special['this']])
+                valence = np.where(active & never_so, valence * 1.5,
+                                   np.where(active & ~never_so & negated, valence * self.constants.N_SCALAR,
+                                            valence))
+            else:
+                never_so = (((prev_raw[3] == special['never']) &
+                             np.isin(prev_raw[2], [special['so'], special['this']])) |
+                            np.isin(prev_raw[1], [special['so'], special['this']]))
+                valence = np.where(active & never_so, valence * 1.25,
+                                   np.where(active & ~never_so & negated, valence * self.constants.N_SCALAR,
+                                            valence))
+                valence = self.idioms_check(valence, active, raw_ids, prev_raw, remaining)
+
+        # negation using 'least'
+        prev_least = (prev_ids[1] == special['least']) & ~self.in_lexicon[special['least']]
+        least_1 = (pos > 1) & prev_least
+        least_2 = ~least_1 & (pos > 0) & prev_least
+        not_at_very = ~np.isin(prev_ids[2], [special['at'], special['very']])
+        valence = np.where(in_lexicon & ((least_1 & not_at_very) | least_2),
+                           valence * self.constants.N_SCALAR, valence)
+
+        # booster words (and 'kind' in 'kind of') get a score of 0 themselves
+        next_ids = shift(ids, -1, -1)
+        kind_of = (remaining > 0) & (ids == special['kind']) & (next_ids == special['of'])
+        valence = np.where(kind_of | (self.booster[ids] != 0), 0.0, valence)
+
+        # repeated words get the score of their first appearance in the comment
+        sentiments = valence[batch['first_index']]
+
+        # words before the first 'but' are down-weighted and words after it are up-weighted
+        comment_ids = batch['comment_ids']
+        is_but = ids == special['but']
+        first_but = np.full(len(texts), np.iinfo(np.int64).max)
+        np.minimum.at(first_but, comment_ids[is_but], pos[is_but])
+        but_pos = first_but[comment_ids]
+        has_but = but_pos < np.iinfo(np.int64).max
+        sentiments = np.where(has_but & (pos < but_pos), sentiments * 0.5,
+                              np.where(has_but & (pos > but_pos), sentiments * 1.5, sentiments))
+
+        # add emphasis from exclamation points and question marks, then normalize
+        sum_s = np.bincount(comment_ids, weights=sentiments, minlength=len(texts))
+        ep_count = np.minimum([text.count('!') for text in texts], 4)
+        qm_count = np.array([text.count('?') for text in texts])
+        qm_amplifier = np.where(qm_count > 3, 0.96, np.where(qm_count > 1, qm_count * 0.18, 0))
+        amplifier = ep_count * 0.292 + qm_amplifier
+        sum_s = np.where(sum_s > 0, sum_s + amplifier, np.where(sum_s < 0, sum_s - amplifier, sum_s))
+
+        compound = sum_s / np.sqrt(sum_s * sum_s + 15)
+
+        return np.round(compound, 4)
+
+    def idioms_check(self, valence, active, raw_ids, prev_raw, remaining):
+        """
+        Vectorized version of SentimentIntensityAnalyzer._idioms_check. Idioms replace the valence of the word.
+        """
+        n = len(raw_ids)
+        next_raw = {1: np.full(n, -1), 2: np.full(n, -1)}
+        next_raw[1][:-1] = raw_ids[1:]
+        next_raw[2][:-2] = raw_ids[2:]
+        next_raw[1] = np.where(remaining > 0, next_raw[1], -1)
+        next_raw[2] = np.where(remaining > 1, next_raw[2], -1)
+
+        def matches(sequence, phrase):
+            return np.logical_and.reduce([s == w for s, w in zip(sequence, phrase)]) if len(sequence) == len(phrase) \
+                else np.zeros(n, dtype=bool)
+
+        # sequences ending at (or just before) the current word -- the first match in this order wins
+        sequences = [
+            (prev_raw[1], raw_ids),
+            (prev_raw[2], prev_raw[1], raw_ids),
+            (prev_raw[2], prev_raw[1]),
+            (prev_raw[3], prev_raw[2], prev_raw[1]),
+            (prev_raw[3], prev_raw[2]),
+        ]
+        idiom_value = np.full(n, np.nan)
+        for sequence in reversed(sequences):
+            for phrase, value in reversed(self.idioms):
+                idiom_value = np.where(matches(sequence, phrase), value, idiom_value)
+
+        # sequences starting at the current word override the ones above
+        for sequence in [(raw_ids, next_raw[1]), (raw_ids, next_raw[1], next_raw[2])]:
+            for phrase, value in self.idioms:
+                idiom_value = np.where(matches(sequence, phrase), value, idiom_value)
+
+        valence = np.where(active & ~np.isnan(idiom_value), idiom_value, valence)
+
+        # booster/dampener bigrams such as 'sort of' or 'kind of'
+        bigram = np.zeros(n, dtype=bool)
+        for phrase in self.booster_bigrams:
+            bigram |= matches((prev_raw[3], prev_raw[2]), phrase) | matches((prev_raw[2], prev_raw[1]), phrase)
+        valence = np.where(active & bigram, valence + self.constants.B_DECR, valence)
+
+        return valence
+
+
+def compare_to_nltk(texts, analyzer=None):
+    """
+    Compare BatchSentimentAnalyzer compound scores to nltk's SentimentIntensityAnalyzer on a reference set of texts.
+
+    :param texts: list of strings
+    :param analyzer: BatchSentimentAnalyzer (creates one with the default lexicon if None)
+    :return: largest absolute difference between the two sets of scores
+    """
+    if analyzer is None:
+        analyzer = BatchSentimentAnalyzer()
+
+    expected = np.array([analyzer.sia.polarity_scores(text)['compound'] for text in texts])
+    actual = analyzer.compound_scores(texts)
+
+    return float(np.max(np.abs(expected - actual))) if len(texts) > 0 else 0.0
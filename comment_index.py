@@ -0,0 +1,310 @@
+###
+#
+# This module builds and queries an inverted index of the comments. The index maps every
+# token and bigram to the comments (and positions within the comments) where it appears,
+# so examples and counts for any feature in the gender analysis results can be looked up
+# without scanning every comment file.
+#
+# Comments are normalized the same way as in 04_feature_analysis_gender.py (guest names
+# scrubbed, lowercased, and tokenized with nlp_utils.make_feature_tokenizer), so the terms
+# in the index match the tokens in the feature analysis output. Search terms that aren't in
+# the index are normalized the same way (e.g., 'Funny' -> 'funny').
+#
+# Comments are tokenized one at a time and bigrams don't cross comments, just like in
+# 04_feature_analysis_gender.py, so the counts by gender match that script's count_0 and
+# count_1 columns (when it runs on every comment with count_clusters_once off).
+#
+# Build the index with `python comment_index.py` (takes about as long as tokenizing the
+# comments for the feature analysis). If the bigram results of the feature analysis exist,
+# the counts of their most common features are checked against the index. Then, e.g.:
+#
+#   index = CommentIndex()
+#   index.counts_by_gender('funny and')
+#   index.sample_comments('funny and', n=10)
+#   index.check_counts(pd.read_pickle('data/gender_analysis_bigram.pickle'))
+#
+###
+
+import array
+import json
+import os
+import time
+import numpy as np
+import pandas as pd
+import scoring_server  # scoring_server.py file
+import utils  # utils.py file
+
+
+def build_index(guest_df, index_dir=utils.index_dir, comment_dir=utils.comment_dir, scrub_names=True, bigrams=True,
+                verbose=True):
+    """
+    Build the inverted index and write it to disk. The index directory will contain:
+      - videos.csv: video_id, guest, female_flag, and season for each video
+      - terms.json: list of terms (tokens and bigrams), where the position in the list is the term ID
+      - term_offsets.npy: postings for term t are entries term_offsets[t] to term_offsets[t + 1] of the arrays below
+      - posting_docs.npy: document (comment) number of each posting
+      - posting_positions.npy: token position of each posting within the comment (first token for bigrams)
+      - doc_videos.npy, doc_comments.npy: video number and index in the comment JSON file of each document
+      - text.bin, text_offsets.npy: UTF-8 text of each comment, so sample comments can be read without the JSON files
+
+    :param guest_df: guest dataframe (see utils.load_guest_list_file)
+    :param index_dir: directory to write the index to
+    :param comment_dir: directory containing the comment JSON files
+    :param scrub_names: if True, replace guest names with a '<name>' token (same as the feature analysis)
+    :param bigrams: if True, index bigrams in addition to single tokens
+    :param verbose: if True, print some status messages
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    start = time.time()
+
+    term_ids = {}
+    postings_terms = array.array('i')
+    postings_docs = array.array('i')
+    postings_positions = array.array('i')
+    doc_videos = array.array('i')
+    doc_comments = array.array('i')
+    text_offsets = array.array('q', [0])
+    videos = []
+    n_docs = 0
+
+    with open(os.path.join(index_dir, 'text.bin'), 'wb') as text_file:
+        for _, row in guest_df.iterrows():
+            video_id = row['video_id']
+            comment_path = os.path.join(comment_dir, f'comments-{video_id}.json')
+            comments_json = json.load(open(comment_path, 'r'))
+            comment_index = [i for i, comment in enumerate(comments_json) if 'commentText' in comment]
+            comments = [comments_json[i]['commentText'] for i in comment_index]
+            del comments_json
+
+            # normalize the same way as the feature analysis
+            if scrub_names:
+                names = utils.get_name_variants(row)
+                scrubbed = [utils.scrub_text(comment, names) for comment in comments]
+            else:
+                scrubbed = comments
+            token_lists = scoring_server.tokenize(scrubbed)
+
+            video_number = len(videos)
+            videos.append({'video_id': video_id, 'guest': row['guest'], 'female_flag': row['female_flag'],
+                           'season': row['season'], 'n_comments': len(comments)})
+
+            for i, tokens in zip(comment_index, token_lists):
+                terms = tokens + [f'{a} {b}' for a, b in zip(tokens[:-1], tokens[1:])] if bigrams else tokens
+                positions = list(range(len(tokens))) + list(range(len(tokens) - 1)) if bigrams \
+                    else list(range(len(tokens)))
+                postings_terms.extend([term_ids.setdefault(term, len(term_ids)) for term in terms])
+                postings_docs.extend([n_docs] * len(terms))
+                postings_positions.extend(positions)
+                doc_videos.append(video_number)
+                doc_comments.append(i)
+                n_docs += 1
+
+            for comment in comments:
+                encoded = comment.encode('utf-8')
+                text_file.write(encoded)
+                text_offsets.append(text_offsets[-1] + len(encoded))
+
+            if verbose:
+                print(f"indexed {row['guest']} -- {len(comments)} comments, {len(term_ids)} terms so far, "
+                      f"{round(time.time() - start)} seconds", flush=True)
+
+    # sort postings by term (stable, so postings for each term stay in document order)
+    postings_terms = np.frombuffer(postings_terms, dtype=np.int32)
+    order = np.argsort(postings_terms, kind='stable')
+    term_offsets = np.zeros(len(term_ids) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum(np.bincount(postings_terms, minlength=len(term_ids)))
+    del postings_terms
+
+    np.save(os.path.join(index_dir, 'term_offsets.npy'), term_offsets)
+    np.save(os.path.join(index_dir, 'posting_docs.npy'), np.frombuffer(postings_docs, dtype=np.int32)[order])
+    np.save(os.path.join(index_dir, 'posting_positions.npy'),
+            np.frombuffer(postings_positions, dtype=np.int32)[order])
+    np.save(os.path.join(index_dir, 'doc_videos.npy'), np.frombuffer(doc_videos, dtype=np.int32))
+    np.save(os.path.join(index_dir, 'doc_comments.npy'), np.frombuffer(doc_comments, dtype=np.int32))
+    np.save(os.path.join(index_dir, 'text_offsets.npy'), np.frombuffer(text_offsets, dtype=np.int64))
+    json.dump(list(term_ids), open(os.path.join(index_dir, 'terms.json'), 'w'))
+    pd.DataFrame(videos).to_csv(os.path.join(index_dir, 'videos.csv'), index=False)
+
+    if verbose:
+        print(f'wrote index with {n_docs} comments and {len(term_ids)} terms to {index_dir} -- '
+              f'{round(time.time() - start)} seconds', flush=True)
+
+
+class CommentIndex:
+    """
+    Query the inverted index written by build_index. The postings and comment text are memory-mapped, so opening the
+    index only has to read the term list, and each query only reads the postings for the terms involved.
+    """
+    def __init__(self, index_dir=utils.index_dir):
+        """
+        :param index_dir: directory containing the index files
+        """
+        self.index_dir = index_dir
+        self.videos = pd.read_csv(os.path.join(index_dir, 'videos.csv'), keep_default_na=False)
+        terms = json.load(open(os.path.join(index_dir, 'terms.json'), 'r'))
+        self.term_ids = {term: i for i, term in enumerate(terms)}
+
+        def load(name):
+            return np.load(os.path.join(index_dir, f'{name}.npy'), mmap_mode='r')
+
+        self.term_offsets = load('term_offsets')
+        self.posting_docs = load('posting_docs')
+        self.posting_positions = load('posting_positions')
+        self.doc_videos = load('doc_videos')
+        self.doc_comments = load('doc_comments')
+        self.text_offsets = load('text_offsets')
+        self.text = np.memmap(os.path.join(index_dir, 'text.bin'), dtype=np.uint8, mode='r') \
+            if self.text_offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+
+    def normalize(self, text):
+        """
+        Tokenize a raw search string the same way as the comments, e.g. 'Funny AND' -> 'funny and'.
+        """
+        return ' '.join(scoring_server.tokenize([text])[0])
+
+    def postings(self, term):
+        """
+        Find every occurrence of a term. Terms are tokens or bigrams as they appear in the feature analysis output
+        (e.g., 'funny' or 'funny and'). Longer phrases are found by combining the postings of their tokens. Terms that
+        aren't in the index are normalized first (see normalize).
+
+        :param term: token, bigram, or space-separated phrase of tokens
+        :return: numpy arrays of document numbers and token positions (of the first token) of each occurrence
+        """
+        if term not in self.term_ids:
+            term = self.normalize(term)
+
+        return self.term_postings(term)
+
+    def term_postings(self, term):
+        """
+        Find every occurrence of an already normalized term (see postings).
+        """
+        if term in self.term_ids:
+            t = self.term_ids[term]
+            start, stop = self.term_offsets[t], self.term_offsets[t + 1]
+            return np.asarray(self.posting_docs[start:stop]), np.asarray(self.posting_positions[start:stop])
+
+        tokens = term.split(' ')
+        if len(tokens) == 1:
+            return np.zeros(0, dtype=np.int32), np.zeros(0, dtype=np.int32)
+
+        # phrase search: keep occurrences of the first token that are followed by the rest of the phrase
+        docs, positions = self.term_postings(tokens[0])
+        keys = docs.astype(np.int64) << 32 | positions
+        for k, token in enumerate(tokens[1:], start=1):
+            next_docs, next_positions = self.term_postings(token)
+            next_keys = next_docs.astype(np.int64) << 32 | (next_positions.astype(np.int64) - k)
+            keys = keys[np.isin(keys, next_keys)]
+
+        return (keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32)
+
+    def counts(self, term):
+        """
+        Count the occurrences of a term for each guest.
+
+        :param term: token, bigram, or phrase (see postings)
+        :return: dataframe with one row per video: guest info, 'count' (occurrences), 'n_comments_with_term', and
+        'rate' (occurrences per comment)
+        """
+        docs, _ = self.postings(term)
+        doc_videos = np.asarray(self.doc_videos)[docs]
+        df = self.videos.copy()
+        df['count'] = np.bincount(doc_videos, minlength=len(df))
+        df['n_comments_with_term'] = np.bincount(np.asarray(self.doc_videos)[np.unique(docs)], minlength=len(df))
+        df['rate'] = df['count'] / df['n_comments'].clip(lower=1)
+
+        return df.sort_values('count', ascending=False).reset_index(drop=True)
+
+    def counts_by_gender(self, term):
+        """
+        Count the occurrences of a term for male and female guests. These are the same as the counts in the feature
+        analysis, unless it uses a sample of the comments or counts near-duplicate clusters once (and features outside
+        its max_features vocabulary aren't in its results at all).
+
+        :param term: token, bigram, or phrase (see postings)
+        :return: dataframe with one row per female_flag value
+        """
+        df = self.counts(term)
+        by_gender = df.groupby('female_flag')[['count', 'n_comments_with_term', 'n_comments']].sum()
+        by_gender['rate_per_1000_comments'] = 1000 * by_gender['count'] / by_gender['n_comments'].clip(lower=1)
+
+        return by_gender.reset_index()
+
+    def check_counts(self, result_df, terms=None, n=20):
+        """
+        Compare the index counts of some features with their counts in the feature analysis results (see
+        counts_by_gender for when they should match).
+
+        :param result_df: feature analysis results dataframe (with token, count_0, and count_1 columns)
+        :param terms: features to check (None for the n most common features in the results)
+        :param n: number of features to check when terms is None
+        :return: dataframe with the counts in the results and in the index of each feature that doesn't match (empty
+        if they all match)
+        """
+        if terms is None:
+            terms = result_df.assign(total=result_df['count_0'] + result_df['count_1']).nlargest(n, 'total')['token']
+        result_counts = result_df.set_index('token')
+        labels = np.unique(self.videos['female_flag'])
+        video_flags = self.videos['female_flag'].values
+
+        rows = []
+        for term in terms:
+            docs, _ = self.term_postings(term)
+            flags = video_flags[np.asarray(self.doc_videos)[docs]]
+            row = {'token': term}
+            for k, label in enumerate(labels):
+                row[f'count_{k}'] = result_counts.loc[term, f'count_{k}'] if term in result_counts.index else 0
+                row[f'index_count_{k}'] = (flags == label).sum()
+            rows.append(row)
+
+        df = pd.DataFrame(rows)
+        match = np.all([df[f'count_{k}'] == df[f'index_count_{k}'] for k in range(len(labels))], axis=0)
+        return df[~match].reset_index(drop=True)
+
+    def comment_text(self, doc):
+        """
+        Get the text of a comment by document number.
+        """
+        return bytes(self.text[self.text_offsets[doc]:self.text_offsets[doc + 1]]).decode('utf-8')
+
+    def sample_comments(self, term, n=5, female_flag=None, seed=0):
+        """
+        Get a random sample of comments that contain a term.
+
+        :param term: token, bigram, or phrase (see postings)
+        :param n: number of comments
+        :param female_flag: only sample comments on videos with this female_flag value (None for all videos)
+        :param seed: random seed
+        :return: dataframe with the guest, video_id, index in the comment JSON file, and text of each comment
+        """
+        docs = np.unique(self.postings(term)[0])
+        if female_flag is not None:
+            video_flags = self.videos['female_flag'].values[np.asarray(self.doc_videos)[docs]]
+            docs = docs[video_flags == female_flag]
+
+        rng = np.random.RandomState(seed)
+        docs = np.sort(rng.choice(docs, min(n, len(docs)), replace=False))
+        videos = self.videos.iloc[np.asarray(self.doc_videos)[docs]]
+
+        return pd.DataFrame({
+            'guest': videos['guest'].values,
+            'female_flag': videos['female_flag'].values,
+            'video_id': videos['video_id'].values,
+            'comment_index': np.asarray(self.doc_comments)[docs],
+            'comment': [self.comment_text(doc) for doc in docs],
+        })
+
+
+if __name__ == '__main__':
+    build_index(utils.load_guest_list_file(apply_filters=True))
+
+    # check the index against the feature analysis results
+    result_file = os.path.join(utils.data_dir, 'gender_analysis_bigram.pickle')
+    if os.path.isfile(result_file):
+        mismatches = CommentIndex().check_counts(pd.read_pickle(result_file))
+        if len(mismatches) == 0:
+            print(f'index counts match {result_file}')
+        else:
+            print(f'index counts differ from {result_file} for {len(mismatches)} features:')
+            print(mismatches.to_string(index=False))
@@ -0,0 +1,291 @@
+###
+#
+# This module runs the gender feature analysis (see 04_feature_analysis_gender.py) for a
+# grid of parameter combinations without redoing shared work. The analysis is split into
+# stages, and each stage's output only depends on some of the parameters:
+#
+#   comments  <- count_clusters_once
+#   tokens    <- comments + scrub_names (every comment is tokenized once, unsampled)
+#   counts    <- tokens + sample_rate + n-gram range (every feature, no max_features limit)
+#   results   <- counts + max_features + prior + alpha
+#
+# Stage outputs are saved in an artifact cache keyed by a hash of the parameters they
+# depend on (plus a fingerprint of the comment files), so each one is computed once per
+# sweep and repeated configurations are loaded from the cache instead of recomputed.
+#
+# Comments are tokenized one at a time and n-grams don't cross comments, the same as in
+# 04_feature_analysis_gender.py, so the counts match that script's output.
+#
+# Set the parameter grid below and run `python feature_sweep.py`.
+#
+###
+
+import hashlib
+import itertools
+import json
+import math
+import os
+import pickle
+import random
+import time
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import CountVectorizer
+import near_duplicates  # near_duplicates.py file
+import nlp_utils as nlp  # nlp_utils.py file
+import scoring_server  # scoring_server.py file
+import utils  # utils.py file
+from models import multinomial_dirichlet_model
+
+
+## Parameters
+parameter_grid = {
+    'sample_rate': [1],
+    'max_features': [20000],
+    'scrub_names': [True],
+    'bigrams': [True],
+    'count_clusters_once': [False],
+    'prior': ['informative'],
+    'alpha': [1],
+}
+summary_file = os.path.join(utils.data_dir, 'gender_analysis_sweep.csv')
+
+
+class ArtifactCache:
+    """
+    Cache of intermediate results stored as pickle files named by a hash of the stage name and parameters. Artifacts
+    used in this session are also kept in memory.
+    """
+    def __init__(self, cache_dir=utils.sweep_cache_dir, keep_in_memory=True):
+        """
+        :param cache_dir: directory for the cache files
+        :param keep_in_memory: if True, keep loaded and computed artifacts in memory as well as on disk
+        """
+        self.cache_dir = cache_dir
+        self.keep_in_memory = keep_in_memory
+        self.memory = {}
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'computed': 0}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, stage, params):
+        """
+        Get the cache key for a stage and its parameters.
+        """
+        encoded = json.dumps({'stage': stage, 'params': params}, sort_keys=True, default=str)
+        return f'{stage}-{hashlib.sha1(encoded.encode()).hexdigest()[:16]}'
+
+    def path(self, stage, params):
+        return os.path.join(self.cache_dir, f'{self.key(stage, params)}.pickle')
+
+    def get(self, stage, params, compute, persist=True):
+        """
+        Get an artifact from the cache, or compute and save it if it isn't there yet.
+
+        :param stage: stage name
+        :param params: dictionary of every parameter the artifact depends on (must be JSON serializable)
+        :param compute: function with no arguments that computes the artifact
+        :param persist: if False, only keep the artifact in memory (for things that are quicker to recompute than load)
+        :return: the artifact
+        """
+        key = self.key(stage, params)
+        if key in self.memory:
+            self.stats['memory_hits'] += 1
+            return self.memory[key]
+
+        path = self.path(stage, params)
+        if persist and os.path.isfile(path):
+            self.stats['disk_hits'] += 1
+            with open(path, 'rb') as f:
+                artifact = pickle.load(f)
+        else:
+            self.stats['computed'] += 1
+            artifact = compute()
+            if persist:
+                # write to a temporary file first so an interrupted run doesn't leave a broken artifact
+                with open(f'{path}.tmp', 'wb') as f:
+                    pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(f'{path}.tmp', path)
+
+        if self.keep_in_memory or not persist:
+            self.memory[key] = artifact
+
+        return artifact
+
+
+def expand_grid(grid):
+    """
+    Turn a dictionary of parameter name -> list of values into a list of dictionaries, one per combination.
+    """
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def data_fingerprint(guest_df, comment_dir=utils.comment_dir, cluster_file=utils.near_duplicate_file):
+    """
+    Fingerprint the input data (guest list, comment files, and near-duplicate clusters) using file sizes and
+    modification times, so cached artifacts are recomputed after the comments are rescraped.
+    """
+    files = [os.path.join(comment_dir, f'comments-{video_id}.json') for video_id in guest_df['video_id']]
+    files += [cluster_file] if os.path.isfile(cluster_file) else []
+    stats = [(file, os.path.getsize(file), os.path.getmtime(file)) for file in files]
+    encoded = json.dumps([guest_df[['video_id', 'guest', 'name_filter', 'female_flag']].values.tolist(), stats],
+                         default=str)
+
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+def load_comments(guest_df, count_clusters_once, comment_dir=utils.comment_dir):
+    """
+    Load the comments of each guest, optionally skipping comments that are near duplicates of an earlier comment.
+
+    :return: dictionary of video_id -> list of comment strings
+    """
+    if count_clusters_once:
+        cluster_df = near_duplicates.load_clusters()
+
+    comments = {}
+    for _, row in guest_df.iterrows():
+        video_id = row['video_id']
+        comments_json = json.load(open(os.path.join(comment_dir, f'comments-{video_id}.json'), 'r'))
+
+        if count_clusters_once:
+            keep = near_duplicates.representative_mask(cluster_df, video_id, comments_json)
+            comments_json = [comment for comment, k in zip(comments_json, keep) if k]
+
+        comments[video_id] = [comment['commentText'] for comment in comments_json if 'commentText' in comment]
+
+    return comments
+
+
+def tokenize_comments(guest_df, comments, scrub_names):
+    """
+    Tokenize every comment the same way as the feature analysis, optionally replacing guest names with '<name>'.
+
+    :return: dictionary of video_id -> list of token lists (one per comment)
+    """
+    tokens = {}
+    for _, row in guest_df.iterrows():
+        texts = comments[row['video_id']]
+        if scrub_names:
+            names = utils.get_name_variants(row)
+            texts = [utils.scrub_text(text, names) for text in texts]
+        tokens[row['video_id']] = scoring_server.tokenize(texts)
+
+    return tokens
+
+
+def sample_comments(n, sample_rate):
+    """
+    Get the indices of the sampled comments of a guest -- the same comments the feature analysis script samples.
+    """
+    if sample_rate >= 1:
+        return range(n)
+
+    random.seed(0)
+    return random.sample(range(n), math.floor(n * sample_rate))
+
+
+def count_features(guest_df, tokens, sample_rate, ngram_range):
+    """
+    Count every token (or n-gram) for each female_flag group, with no limit on the number of features.
+
+    :return: (2xn sparse matrix of counts, list of feature names)
+    """
+    groups = {}
+    for label in np.unique(guest_df['female_flag']):
+        group_tokens = []
+        for video_id in guest_df.loc[guest_df['female_flag'] == label, 'video_id']:
+            video_tokens = tokens[video_id]
+            group_tokens += [video_tokens[i] for i in sample_comments(len(video_tokens), sample_rate)]
+        groups[label] = group_tokens
+
+    # the documents are lists of already tokenized comments, so CountVectorizer only counts their n-grams
+    cv = CountVectorizer(analyzer=lambda doc: nlp.comment_ngrams(doc, ngram_range))
+    counts = cv.fit_transform(groups.values())
+
+    return counts, list(cv.get_feature_names())
+
+
+def limit_features(counts, feature_names, max_features):
+    """
+    Keep the max_features most common features, chosen the same way as CountVectorizer(max_features=...).
+    """
+    if max_features is None or max_features >= counts.shape[1]:
+        return counts, feature_names
+
+    keep = np.sort((-np.asarray(counts.sum(axis=0)).ravel()).argsort()[:max_features])
+    return counts[:, keep], [feature_names[i] for i in keep]
+
+
+def run_sweep(grid, guest_df=None, cache=None, comment_dir=utils.comment_dir, verbose=True):
+    """
+    Run the feature analysis for every combination of parameters in a grid, computing each shared stage only once.
+
+    :param grid: dictionary of parameter name -> list of values (see parameter_grid for the parameter names)
+    :param guest_df: guest dataframe (None to load the filtered guest list)
+    :param cache: ArtifactCache (None to use the default cache directory)
+    :param comment_dir: directory containing the comment JSON files
+    :param verbose: if True, print some status messages
+    :return: dataframe with one row per configuration and analysis (word or bigram) with the parameters, number of
+    features, top features for each group, and the cache file of the results dataframe
+    """
+    start = time.time()
+    if guest_df is None:
+        guest_df = utils.load_guest_list_file(apply_filters=True)
+    if cache is None:
+        cache = ArtifactCache()
+    data = data_fingerprint(guest_df, comment_dir)
+
+    summary = []
+    for config in expand_grid(grid):
+        comment_params = {'data': data, 'count_clusters_once': config['count_clusters_once']}
+        token_params = dict(comment_params, scrub_names=config['scrub_names'])
+
+        def get_comments():
+            return cache.get('comments', comment_params, persist=False, compute=lambda: load_comments(
+                guest_df, config['count_clusters_once'], comment_dir))
+
+        def get_tokens():
+            return cache.get('tokens', token_params, compute=lambda: tokenize_comments(
+                guest_df, get_comments(), config['scrub_names']))
+
+        analyses = [('word', (1, 1))] + ([('bigram', (1, 2))] if config['bigrams'] else [])
+        for analysis, ngram_range in analyses:
+            # (counts cached before n-grams stopped crossing comments don't have the 'ngrams' entry, so they
+            # aren't reused)
+            count_params = dict(token_params, sample_rate=config['sample_rate'], ngram_range=ngram_range,
+                                ngrams='per_comment')
+            result_params = dict(count_params, max_features=config['max_features'], prior=config['prior'],
+                                 alpha=config['alpha'])
+
+            def get_counts():
+                return cache.get('counts', count_params, compute=lambda: count_features(
+                    guest_df, get_tokens(), config['sample_rate'], ngram_range))
+
+            def get_results():
+                counts, feature_names = limit_features(*get_counts(), config['max_features'])
+                return multinomial_dirichlet_model(counts, feature_names=feature_names, prior=config['prior'],
+                                                   alpha=config['alpha'])
+
+            df = cache.get('results', result_params, compute=get_results)
+            summary.append(dict(config, analysis=analysis, n_features=len(df),
+                                top_features_0=', '.join(df['token'].iloc[::-1][:10].astype(str)),
+                                top_features_1=', '.join(df['token'][:10].astype(str)),
+                                result_file=cache.path('results', result_params)))
+
+            if verbose:
+                print(f"{analysis} analysis for {config} -- {round(time.time() - start)} seconds", flush=True)
+
+    if verbose:
+        print(f"cache: {cache.stats['computed']} artifacts computed, {cache.stats['disk_hits']} loaded from disk, "
+              f"{cache.stats['memory_hits']} reused in memory", flush=True)
+
+    return pd.DataFrame(summary)
+
+
+if __name__ == '__main__':
+    print(f'starting at {datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")}', flush=True)
+    summary_df = run_sweep(parameter_grid)
+    summary_df.to_csv(summary_file, index=False)
+    print(f'finished at {datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")}')
@@ -1,6 +1,6 @@
 import numpy as np
 import pandas as pd
-from scipy.sparse import issparse
+from scipy.sparse import issparse, csr_matrix
 
 
 def multinomial_dirichlet_model(counts, feature_names=None, prior='informative', alpha=1):
@@ -77,3 +77,109 @@ def multinomial_dirichlet_model(counts, feature_names=None, prior='informative',
     })
 
     return df.sort_values('z_score').reset_index(drop=True)
+
+
+def sparse_multinomial_dirichlet_model(counts, feature_names=None, prior='informative', alpha=1, top_k=1000,
+                                       dtype=np.float64, result_file=None):
+    """
+    Same model as multinomial_dirichlet_model, but for very large vocabularies (e.g., every n-gram in the corpus rather
+    than the most common 20,000). The counts can stay sparse, the statistics are computed in flat numpy arrays of the
+    given dtype, and only the top_k most extreme z-scores in each direction are put into a dataframe. The top features
+    are found with a partial sort (np.argpartition) instead of sorting every feature.
+
+    The full results can optionally be written to a memory-mapped .npy file (a structured array with one row per
+    feature, in feature_index order) that can be opened later with np.load(result_file, mmap_mode='r').
+
+    :param counts: 2xn numpy array or scipy sparse matrix of word counts: row 0 has counts for group 0, row 1 has
+    counts for group 1
+    :param feature_names: feature names (e.g., words or n-grams) corresponding to columns of counts matrix
+    :param prior: 'informative' or 'uniform'
+    :param alpha: strength of prior (default = 1)
+    :param top_k: number of features to keep with the most negative z-scores and with the most positive z-scores
+    :param dtype: float type for the calculations (np.float32 uses half the memory)
+    :param result_file: path of a .npy file to write the full results to (None to skip)
+
+    :return: a pandas dataframe with z-scores and other stats for the top features, sorted by z-score
+    """
+    # counts must be numpy array or sparse matrix with two rows
+    if not (issparse(counts) or isinstance(counts, np.ndarray)):
+        raise TypeError('counts must by numpy array or scipy sparse matrix')
+    if counts.shape[0] != 2:
+        raise ValueError('counts must have two rows -- one for each set being compared')
+
+    # only the two rows of counts are made dense (one value per feature), never a full dataframe
+    if issparse(counts):
+        counts = csr_matrix(counts)
+        count_0 = counts[0].toarray().ravel()
+        count_1 = counts[1].toarray().ravel()
+    else:
+        count_0, count_1 = counts[0], counts[1]
+
+    n_features = counts.shape[1]
+    count_0 = count_0.astype(dtype)
+    count_1 = count_1.astype(dtype)
+    total_0 = count_0.sum(dtype=np.float64)
+    total_1 = count_1.sum(dtype=np.float64)
+
+    # set up prior
+    if prior == 'informative':
+        prior = (alpha * (count_0 + count_1) / (total_0 + total_1)).astype(dtype)
+        prior_sum = float(alpha)
+    elif prior == 'uniform':
+        prior = dtype(alpha)
+        prior_sum = float(alpha) * n_features
+    else:
+        raise ValueError("prior must be 'informative' or 'uniform'")
+
+    # compute log odds ratio, variance, and z_scores
+    a_0 = count_0 + prior
+    b_0 = dtype(total_0 + prior_sum) - a_0
+    a_1 = count_1 + prior
+    b_1 = dtype(total_1 + prior_sum) - a_1
+
+    log_odds_ratio = np.log(a_0) - np.log(b_0) - np.log(a_1) + np.log(b_1)
+    variance = 1 / a_0 + 1 / b_0 + 1 / a_1 + 1 / b_1
+    del a_0, b_0, a_1, b_1
+    z_scores = log_odds_ratio / np.sqrt(variance)
+
+    # optionally write everything to a memory-mapped file
+    if result_file is not None:
+        results = np.lib.format.open_memmap(result_file, mode='w+', shape=(n_features,), dtype=[
+            ('count_0', dtype), ('count_1', dtype), ('log_odds_ratio', dtype), ('variance', dtype),
+            ('z_score', dtype)])
+        results['count_0'] = count_0
+        results['count_1'] = count_1
+        results['log_odds_ratio'] = log_odds_ratio
+        results['variance'] = variance
+        results['z_score'] = z_scores
+        results.flush()
+        del results
+
+    # find the top_k most negative and most positive z-scores without sorting everything
+    k = min(top_k, n_features)
+    if 2 * k >= n_features:
+        top = np.arange(n_features)
+    else:
+        lowest = np.argpartition(z_scores, k - 1)[:k]
+        highest = np.argpartition(z_scores, n_features - k)[n_features - k:]
+        top = np.concatenate([lowest, highest])
+    top = top[np.argsort(z_scores[top], kind='stable')]
+
+    # put the top features into a dataframe
+    if feature_names is None:
+        tokens = top
+    else:
+        tokens = [feature_names[i] for i in top]
+    df = pd.DataFrame({
+        'token': tokens,
+        'feature_index': top,
+        'count_0': count_0[top],
+        'count_1': count_1[top],
+        'freq_0': count_0[top] / total_0,
+        'freq_1': count_1[top] / total_1,
+        'log_odds_ratio': log_odds_ratio[top],
+        'variance': variance[top],
+        'z_score': z_scores[top]
+    })
+
+    return df
@@ -0,0 +1,313 @@
+###
+#
+# This module finds near-duplicate comments (spam, copypasta, and small variations of the
+# same comment) within and across videos using MinHash signatures and locality-sensitive
+# hashing (LSH). Each comment is assigned a cluster ID, and the first comment in each
+# cluster is marked as its representative.
+#
+# 03_get_perspective_scores.py uses the clusters to score one comment per cluster and copy
+# the scores to the rest of the cluster, and 04_feature_analysis_gender.py can optionally
+# count each cluster only once.
+#
+# Run `python near_duplicates.py` to find the clusters for all scraped videos, write them
+# to the cluster file, and print how many API calls and tokens they save.
+#
+###
+
+import json
+import os
+import re
+import time
+import numpy as np
+import pandas as pd
+import score_store  # score_store.py file
+import utils  # utils.py file
+
+
+# random constants for hashing -- fixed so the clusters are the same every time
+hash_seed = 20190708
+non_word_regex = re.compile(r'[\W_]+')
+
+
+def normalize_text(text):
+    """
+    Lowercase a comment and replace punctuation, emojis, and extra whitespace with a single space. Comments that are
+    nothing but punctuation/emojis are left as they are (so they only match identical comments).
+    """
+    normalized = non_word_regex.sub(' ', text.lower()).strip()
+    return normalized if normalized else text
+
+
+def minhash_signatures(texts, num_perm=64, shingle_size=5, seed=hash_seed):
+    """
+    Compute MinHash signatures of character shingles for a list of comments. Everything after normalizing the text is
+    vectorized: the shingles of all comments are packed into one integer array (shingles are at most 8 bytes, so the
+    bytes themselves are the shingle ID) and each hash function is applied to the whole array at once.
+
+    :param texts: list of comment strings
+    :param num_perm: number of hash functions (signature length)
+    :param shingle_size: number of bytes per shingle (at most 8)
+    :param seed: random seed for the hash functions
+    :return: (len(texts) x num_perm) uint32 array of signatures; comments with no text get all zeros
+    """
+    if not 0 < shingle_size <= 8:
+        raise ValueError('shingle_size must be between 1 and 8')
+
+    encoded = [normalize_text(text).encode('utf-8') for text in texts]
+    lengths = np.array([len(e) for e in encoded], dtype=np.int64)
+    signatures = np.zeros((len(texts), num_perm), dtype=np.uint32)
+    if lengths.sum() == 0:
+        return signatures
+
+    # pad each comment so short comments still get a shingle and shingles don't run into the next comment
+    pad = b'\0' * (shingle_size - 1)
+    buffer = np.frombuffer(b''.join(e + pad for e in encoded) + pad, dtype=np.uint8).astype(np.uint64)
+    comment_starts = np.concatenate([[0], np.cumsum(lengths + shingle_size - 1)[:-1]])
+
+    # one shingle starting at each byte of each comment
+    has_text = lengths > 0
+    shingle_starts = np.repeat(comment_starts[has_text], lengths[has_text]) + \
+        np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths[has_text]) - lengths[has_text], lengths[has_text])
+    shingles = np.zeros(len(shingle_starts), dtype=np.uint64)
+    for j in range(shingle_size):
+        shingles = (shingles << np.uint64(8)) | buffer[shingle_starts + j]
+    del buffer, shingle_starts
+
+    # mix the bits before applying the hash functions
+    with np.errstate(over='ignore'):
+        shingles *= np.uint64(0x9E3779B97F4A7C15)
+        shingles ^= shingles >> np.uint64(29)
+
+    rng = np.random.RandomState(seed)
+    a = rng.randint(0, 2 ** 62, num_perm, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+    b = rng.randint(0, 2 ** 62, num_perm, dtype=np.int64).astype(np.uint64)
+    group_starts = np.concatenate([[0], np.cumsum(lengths[has_text])[:-1]])
+
+    for p in range(num_perm):
+        with np.errstate(over='ignore'):
+            hashes = ((a[p] * shingles + b[p]) >> np.uint64(32)).astype(np.uint32)
+        signatures[has_text, p] = np.minimum.reduceat(hashes, group_starts)
+
+    return signatures
+
+
+def connected_components(n, edges_i, edges_j):
+    """
+    Label the connected components of a graph with n nodes, where each component is labeled with its smallest node.
+    Uses label propagation with pointer jumping, so it only needs numpy operations.
+    """
+    labels = np.arange(n)
+    if len(edges_i) == 0:
+        return labels
+
+    while True:
+        new_labels = labels.copy()
+        np.minimum.at(new_labels, edges_i, labels[edges_j])
+        np.minimum.at(new_labels, edges_j, labels[edges_i])
+        while True:
+            jumped = new_labels[new_labels]
+            if np.array_equal(jumped, new_labels):
+                break
+            new_labels = jumped
+        if np.array_equal(new_labels, labels):
+            return labels
+        labels = new_labels
+
+
+def cluster_signatures(signatures, has_text, bands=16, threshold=0.8, seed=hash_seed, edge_batch_size=1000000):
+    """
+    Group comments into near-duplicate clusters with LSH. Comments whose signatures are identical in at least one band
+    are candidate pairs, and candidates are kept if their estimated Jaccard similarity is at least the threshold.
+
+    :param signatures: (n x num_perm) array of MinHash signatures
+    :param has_text: boolean array -- comments without text are never clustered with anything
+    :param bands: number of LSH bands (must divide num_perm)
+    :param threshold: minimum estimated Jaccard similarity of shingles for two comments to be near duplicates
+    :param seed: random seed for hashing the bands
+    :param edge_batch_size: number of candidate pairs to verify at once
+    :return: array with the cluster label of each comment (the index of the first comment in the cluster)
+    """
+    n, num_perm = signatures.shape
+    if num_perm % bands != 0:
+        raise ValueError('bands must divide the number of hash functions')
+    rows = num_perm // bands
+
+    rng = np.random.RandomState(seed + 1)
+    multipliers = rng.randint(0, 2 ** 62, rows, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+    candidates = np.where(has_text)[0]
+
+    edges_i, edges_j = [], []
+    for band in range(bands):
+        band_signatures = signatures[candidates, band * rows:(band + 1) * rows].astype(np.uint64)
+        with np.errstate(over='ignore'):
+            keys = (band_signatures * multipliers).sum(axis=1) + np.uint64(band)
+
+        # link every comment in a bucket to the first comment in the bucket
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        new_bucket = np.concatenate([[True], sorted_keys[1:] != sorted_keys[:-1]])
+        first_in_bucket = order[np.maximum.accumulate(np.where(new_bucket, np.arange(len(order)), 0))]
+        linked = ~new_bucket
+        edges_i.append(candidates[order[linked]])
+        edges_j.append(candidates[first_in_bucket[linked]])
+
+    edges_i = np.concatenate(edges_i) if edges_i else np.zeros(0, dtype=np.int64)
+    edges_j = np.concatenate(edges_j) if edges_j else np.zeros(0, dtype=np.int64)
+
+    # verify the candidate pairs with the full signatures
+    keep = np.zeros(len(edges_i), dtype=bool)
+    for start in range(0, len(edges_i), edge_batch_size):
+        i, j = edges_i[start:start + edge_batch_size], edges_j[start:start + edge_batch_size]
+        keep[start:start + edge_batch_size] = (signatures[i] == signatures[j]).mean(axis=1) >= threshold
+
+    return connected_components(n, edges_i[keep], edges_j[keep])
+
+
+def find_clusters(guest_df, comment_dir=utils.comment_dir, num_perm=64, bands=16, threshold=0.8, verbose=True):
+    """
+    Find near-duplicate clusters across all comments of the videos in the guest dataframe.
+
+    :param guest_df: guest dataframe (see utils.load_guest_list_file) -- only scraped videos are used
+    :param comment_dir: directory containing the comment JSON files
+    :param num_perm: number of MinHash hash functions
+    :param bands: number of LSH bands
+    :param threshold: minimum estimated Jaccard similarity for two comments to be near duplicates
+    :param verbose: if True, print some status messages
+    :return: dataframe with one row per comment: video_id, comment_id (see score_store.comment_ids), comment_index
+    (position in the JSON file when the clusters were found), cluster_id, cluster_size, is_representative, and n_tokens
+    (number of space-separated words)
+    """
+    start = time.time()
+    video_ids, comment_ids, comment_index, n_tokens, has_text, signatures = [], [], [], [], [], []
+
+    for _, row in guest_df.iterrows():
+        if (row['video_id'] == '') or (row['done'] not in [1, '1']):
+            continue
+
+        comment_path = os.path.join(comment_dir, f"comments-{row['video_id']}.json")
+        comments = json.load(open(comment_path, 'r'))
+        texts = [comment.get('commentText', '') for comment in comments]
+
+        video_ids += [row['video_id']] * len(texts)
+        comment_ids += score_store.comment_ids(comments)
+        comment_index.append(np.arange(len(texts)))
+        n_tokens.append(np.array([len(text.split()) for text in texts], dtype=np.int64))
+        has_text.append(np.array([len(text) > 0 for text in texts], dtype=bool))
+        signatures.append(minhash_signatures(texts, num_perm=num_perm))
+
+        if verbose:
+            print(f"computed signatures for {row['guest']} -- {len(texts)} comments, "
+                  f"{round(time.time() - start)} seconds", flush=True)
+
+    signatures = np.concatenate(signatures) if signatures else np.zeros((0, num_perm), dtype=np.uint32)
+    has_text = np.concatenate(has_text) if has_text else np.zeros(0, dtype=bool)
+    labels = cluster_signatures(signatures, has_text, bands=bands, threshold=threshold)
+
+    # number the clusters in order of their first comment
+    _, cluster_ids, cluster_sizes = np.unique(labels, return_inverse=True, return_counts=True)
+    df = pd.DataFrame({
+        'video_id': video_ids,
+        'comment_id': comment_ids,
+        'comment_index': np.concatenate(comment_index) if comment_index else np.zeros(0, dtype=int),
+        'cluster_id': cluster_ids,
+        'cluster_size': cluster_sizes[cluster_ids],
+        'is_representative': labels == np.arange(len(labels)),
+        'n_tokens': np.concatenate(n_tokens) if n_tokens else np.zeros(0, dtype=int),
+        'has_text': has_text,
+    })
+
+    if verbose:
+        print(f'found {df["cluster_id"].nunique()} clusters in {len(df)} comments -- '
+              f'{round(time.time() - start)} seconds', flush=True)
+
+    return df
+
+
+def save_clusters(df, file=utils.near_duplicate_file):
+    """
+    Write the near-duplicate clusters to a CSV file.
+    """
+    df.to_csv(file, index=False)
+
+
+def load_clusters(file=utils.near_duplicate_file):
+    """
+    Read the near-duplicate clusters from the CSV file.
+    """
+    df = pd.read_csv(file, dtype={'video_id': str, 'comment_id': str})
+    if 'comment_id' not in df.columns:
+        raise ValueError(f'{file} was written by an older version without comment IDs -- run near_duplicates.py again')
+
+    return df
+
+
+def get_video_clusters(df, video_id, comments):
+    """
+    Get the cluster ID of each comment of a video, matched by comment ID (see score_store.comment_ids) so the clusters
+    can't attach to the wrong comments if the video was scraped again.
+
+    :param df: cluster dataframe (see find_clusters)
+    :param video_id: YouTube video ID
+    :param comments: list of comment dictionaries from the video's comment file
+    :return: list with the cluster ID of each comment in the file, in order (None for comments that aren't in the
+    clusters, e.g. new comments from a rescrape)
+    """
+    video_clusters = df.loc[df['video_id'] == video_id].drop_duplicates('comment_id')
+    cluster_ids = dict(zip(video_clusters['comment_id'], video_clusters['cluster_id']))
+
+    return [cluster_ids.get(comment_id) for comment_id in score_store.comment_ids(comments)]
+
+
+def representative_mask(df, video_id, comments):
+    """
+    Get whether each comment of a video is the representative of its near-duplicate cluster, matched by comment ID.
+    Comments that aren't in the clusters are their own representatives, and a comment ID that appears more than once
+    in the file is only counted once.
+
+    :param df: cluster dataframe (see find_clusters)
+    :param video_id: YouTube video ID
+    :param comments: list of comment dictionaries from the video's comment file
+    :return: boolean numpy array with one entry per comment in the file
+    """
+    video_clusters = df.loc[df['video_id'] == video_id].drop_duplicates('comment_id')
+    representatives = dict(zip(video_clusters['comment_id'], video_clusters['is_representative'].astype(bool)))
+    ids = pd.Series(score_store.comment_ids(comments))
+
+    keep = np.array([representatives.get(comment_id, True) for comment_id in ids], dtype=bool)
+    return keep & ~ids.duplicated().values
+
+
+def report_savings(df):
+    """
+    Summarize how much work the near-duplicate clusters save: Perspective API calls (one call per cluster instead of
+    one per comment) and tokens in the feature analysis (if each cluster is only counted once).
+
+    :param df: cluster dataframe (see find_clusters)
+    :return: dictionary of summary numbers
+    """
+    text_df = df[df['has_text']]
+    duplicates = text_df[~text_df['is_representative']]
+    summary = {
+        'comments': len(text_df),
+        'clusters': text_df['cluster_id'].nunique(),
+        'api_calls_saved': len(duplicates),
+        'api_calls_saved_pct': 100 * len(duplicates) / max(len(text_df), 1),
+        'tokens': int(text_df['n_tokens'].sum()),
+        'tokens_saved': int(duplicates['n_tokens'].sum()),
+        'tokens_saved_pct': 100 * duplicates['n_tokens'].sum() / max(text_df['n_tokens'].sum(), 1),
+        'cross_video_clusters': int((text_df.groupby('cluster_id')['video_id'].nunique() > 1).sum()),
+    }
+
+    print(f"{summary['comments']} comments in {summary['clusters']} near-duplicate clusters "
+          f"({summary['cross_video_clusters']} clusters span multiple videos)")
+    print(f"Perspective API calls saved: {summary['api_calls_saved']} ({summary['api_calls_saved_pct']:.1f}%)")
+    print(f"tokens saved by counting each cluster once: {summary['tokens_saved']} "
+          f"({summary['tokens_saved_pct']:.1f}%)")
+
+    return summary
+
+
+if __name__ == '__main__':
+    cluster_df = find_clusters(utils.load_guest_list_file())
+    save_clusters(cluster_df)
+    report_savings(cluster_df)
@@ -0,0 +1,249 @@
+###
+#
+# This module counts higher-order n-grams (trigrams, 4-grams, ...) for the feature analysis
+# without holding every distinct n-gram in memory the way CountVectorizer does.
+#
+# For each n-gram size, it makes two passes over the token IDs of each group:
+#   1. every n-gram is hashed into a count-min sketch (a table of counters that can only
+#      overestimate counts), with one counter per n-gram position by default so few
+#      infrequent n-grams share counters with frequent ones
+#   2. n-grams whose sketch count is below min_count are dropped -- they can't be frequent
+#      enough to keep -- and the rest are counted exactly
+#
+# The counters stop at min_count (that's all pass 2 needs to know), so they only take one
+# byte each.
+#
+# SketchNgramCounter has the same fit_transform/get_feature_names interface as
+# CountVectorizer, so its output can be passed straight to multinomial_dirichlet_model.
+#
+###
+
+import array
+import re
+import numpy as np
+from scipy.sparse import csr_matrix
+
+
+# random constants for hashing -- fixed so the results are the same every time
+hash_seed = 20190708
+default_token_pattern = re.compile(r'(?u)\b\w\w+\b')  # CountVectorizer's default token pattern
+
+
+class SketchNgramCounter:
+    """
+    Count n-grams in a list of documents (e.g., the concatenated comments for each gender group) using a count-min
+    sketch to prune infrequent n-grams before counting the rest exactly. Counts for n-grams that appear at least
+    min_count times in total are exact; n-grams that appear fewer times are left out.
+    """
+    def __init__(self, tokenizer=None, ngram_range=(1, 1), max_features=None, min_count=5, lowercase=True,
+                 sketch_width=None, sketch_depth=4, max_candidates=50000000, chunk_size=10000000, seed=hash_seed):
+        """
+        :param tokenizer: function that splits a string into a list of tokens (None to use CountVectorizer's default
+        token pattern)
+        :param ngram_range: (min_n, max_n) tuple of n-gram sizes to count
+        :param max_features: only keep this many n-grams with the highest total counts (None to keep all of them)
+        :param min_count: drop n-grams that appear fewer times than this across all documents
+        :param lowercase: if True, lowercase the text before tokenizing (like CountVectorizer)
+        :param sketch_width: number of counters in each row of the sketch for each n-gram size -- wider means fewer
+        infrequent n-grams get through to the exact count (None to use the number of n-gram positions, rounded up to a
+        power of two)
+        :param sketch_depth: number of rows (hash functions) in the sketch
+        :param max_candidates: raise an error if more than this many n-grams of a document get through the sketch (a
+        sign that the sketch is too narrow and the exact count would use too much memory)
+        :param chunk_size: number of n-gram positions to hash at once (limits the size of the temporary arrays)
+        :param seed: random seed for the hash functions
+        """
+        self.tokenizer = tokenizer
+        self.ngram_range = ngram_range
+        self.max_features = max_features
+        self.min_count = min_count
+        self.lowercase = lowercase
+        self.sketch_width = sketch_width
+        self.sketch_depth = sketch_depth
+        self.max_candidates = max_candidates
+        self.chunk_size = chunk_size
+        self.seed = seed
+
+        self.vocabulary_ = None
+        self.feature_names_ = None
+        self.stats_ = None
+
+    def tokenize(self, text):
+        if self.lowercase:
+            text = text.lower()
+        if self.tokenizer is None:
+            return default_token_pattern.findall(text)
+        return self.tokenizer(text)
+
+    def token_ids(self, doc, token_vocab):
+        """
+        Tokenize a document and convert the tokens to integer IDs, adding new tokens to the token vocabulary. A
+        document can be a string or a list of strings -- in a list, n-grams don't cross from one string to the next.
+
+        :param doc: string or list of strings
+        :param token_vocab: dictionary of token -> ID
+        :return: int32 numpy array of token IDs, with -1 between the strings of a list
+        """
+        texts = [doc] if isinstance(doc, str) else doc
+        ids = array.array('i')
+        for k, text in enumerate(texts):
+            if k > 0:
+                ids.append(-1)
+            ids.extend([token_vocab.setdefault(token, len(token_vocab)) for token in self.tokenize(text)])
+
+        return np.frombuffer(ids, dtype=np.int32) if len(ids) > 0 else np.zeros(0, dtype=np.int32)
+
+    def hash_chunks(self, ids, n, width):
+        """
+        Hash the n-grams of a token ID array in chunks of positions.
+
+        :param ids: token ID array (see token_ids)
+        :param n: n-gram size
+        :param width: number of columns in the sketch
+
+        :return: generator of (positions, buckets) where positions are the start positions of n-grams that don't cross
+        a -1 separator and buckets is a (sketch_depth x len(positions)) array of sketch columns
+        """
+        rng = np.random.RandomState(self.seed + n)
+        a = rng.randint(0, 2 ** 62, self.sketch_depth, dtype=np.int64).astype(np.uint64) * np.uint64(2) + np.uint64(1)
+        b = rng.randint(0, 2 ** 62, self.sketch_depth, dtype=np.int64).astype(np.uint64)
+        n_positions = len(ids) - n + 1
+
+        for start in range(0, max(n_positions, 0), self.chunk_size):
+            stop = min(start + self.chunk_size, n_positions)
+            valid = np.ones(stop - start, dtype=bool)
+            h = np.full(stop - start, n, dtype=np.uint64)
+            with np.errstate(over='ignore'):
+                for j in range(n):
+                    window = ids[start + j:stop + j]
+                    valid &= window >= 0
+                    h = (h ^ window.astype(np.uint64)) * np.uint64(0x9E3779B97F4A7C15)
+                    h ^= h >> np.uint64(29)
+
+                positions = np.arange(start, stop)[valid]
+                h = h[valid]
+                buckets = np.stack([((a[d] * h + b[d]) >> np.uint64(32)) % np.uint64(width)
+                                    for d in range(self.sketch_depth)]).astype(np.int64)
+
+            yield positions, buckets
+
+    def build_sketch(self, doc_ids, n):
+        """
+        Add every n-gram of every document to a count-min sketch whose counters stop at min_count.
+
+        :param doc_ids: list of token ID arrays (see token_ids)
+        :param n: n-gram size
+        :return: (sketch_depth x width) array of counters
+        """
+        width = self.sketch_width
+        if width is None:
+            n_positions = sum(max(len(ids) - n + 1, 0) for ids in doc_ids)
+            width = 2 ** int(np.ceil(np.log2(max(n_positions, 1))))
+
+        sketch = np.zeros((self.sketch_depth, width), dtype=np.uint8 if self.min_count < 256 else np.int64)
+        for ids in doc_ids:
+            for _, buckets in self.hash_chunks(ids, n, width):
+                for d in range(self.sketch_depth):
+                    columns, counts = np.unique(buckets[d], return_counts=True)
+                    sketch[d, columns] = np.minimum(sketch[d, columns] + counts, self.min_count)
+
+        return sketch
+
+    def count_survivors(self, ids, n, sketch):
+        """
+        Exactly count the n-grams of a token ID array whose sketch count is at least min_count.
+
+        :return: (unique n-grams as a k x n array of token IDs, count of each)
+        """
+        ngrams, counts = [np.zeros((0, n), dtype=np.int32)], [np.zeros(0, dtype=np.int64)]
+        n_candidates = 0
+        for positions, buckets in self.hash_chunks(ids, n, sketch.shape[1]):
+            estimates = sketch[np.arange(self.sketch_depth)[:, None], buckets].min(axis=0)
+            positions = positions[estimates >= self.min_count]
+            chunk_ngrams = np.stack([ids[positions + j] for j in range(n)], axis=1)
+            chunk_ngrams, chunk_counts = np.unique(chunk_ngrams, axis=0, return_counts=True)
+            ngrams.append(chunk_ngrams)
+            counts.append(chunk_counts)
+
+            # keep the exact count from taking the memory the sketch is supposed to save
+            n_candidates += len(chunk_ngrams)
+            if self.max_candidates is not None and n_candidates > self.max_candidates:
+                raise ValueError(f'more than {self.max_candidates:,} {n}-grams got through the sketch -- increase '
+                                 f'sketch_width or sketch_depth (or max_candidates)')
+
+        return merge_counts(np.concatenate(ngrams), np.concatenate(counts))
+
+    def fit_transform(self, raw_documents):
+        """
+        Count the n-grams in each document.
+
+        :param raw_documents: list of documents (strings, or lists of strings -- see token_ids)
+        :return: (n_documents x n_features) sparse matrix of counts, with features in alphabetical order like
+        CountVectorizer
+        """
+        token_vocab = {}
+        doc_ids = [self.token_ids(doc, token_vocab) for doc in raw_documents]
+        tokens = np.array(list(token_vocab), dtype=object)
+        min_n, max_n = self.ngram_range
+
+        # for each n-gram size, build its sketch and count the n-grams that get through it exactly (one sketch at a
+        # time, so each one can be as wide as its number of n-grams)
+        names, doc_counts = [], []
+        total_positions, surviving_ngrams = 0, 0
+        for n in range(min_n, max_n + 1):
+            if n == 1:
+                per_doc = [merge_counts(ids[ids >= 0][:, None], np.ones((ids >= 0).sum(), dtype=np.int64))
+                           for ids in doc_ids]
+            else:
+                sketch = self.build_sketch(doc_ids, n)
+                per_doc = [self.count_survivors(ids, n, sketch) for ids in doc_ids]
+                del sketch
+            total_positions += sum(len(ids) - n + 1 for ids in doc_ids if len(ids) >= n)
+
+            # line up the counts of each document and drop false positives from the sketch
+            all_ngrams, inverse = np.unique(np.concatenate([ngrams for ngrams, _ in per_doc]), axis=0,
+                                            return_inverse=True)
+            inverse = inverse.ravel()
+            counts = np.zeros((len(per_doc), len(all_ngrams)), dtype=np.int64)
+            offset = 0
+            for d, (ngrams, c) in enumerate(per_doc):
+                counts[d] = np.bincount(inverse[offset:offset + len(ngrams)], weights=c, minlength=len(all_ngrams))
+                offset += len(ngrams)
+            keep = counts.sum(axis=0) >= self.min_count
+            surviving_ngrams += len(all_ngrams)
+
+            names += [' '.join(row) for row in tokens[all_ngrams[keep]]]
+            doc_counts.append(counts[:, keep])
+
+        counts = np.concatenate(doc_counts, axis=1) if doc_counts else np.zeros((len(doc_ids), 0), dtype=np.int64)
+        names = np.array(names, dtype=object)
+
+        # keep the most frequent features (ties go to the first one alphabetically) and sort alphabetically
+        order = np.argsort(names.astype(str), kind='stable')
+        names, counts = names[order], counts[:, order]
+        if self.max_features is not None and len(names) > self.max_features:
+            keep = np.sort(np.argsort(-counts.sum(axis=0), kind='stable')[:self.max_features])
+            names, counts = names[keep], counts[:, keep]
+
+        self.feature_names_ = list(names)
+        self.vocabulary_ = {name: i for i, name in enumerate(self.feature_names_)}
+        self.stats_ = {'tokens': len(tokens), 'ngram_positions': total_positions,
+                       'counted_exactly': surviving_ngrams, 'features': len(self.feature_names_)}
+
+        return csr_matrix(counts)
+
+    def get_feature_names(self):
+        return self.feature_names_
+
+
+def merge_counts(ngrams, counts):
+    """
+    Combine the counts of repeated rows of an array of n-grams (one row of token IDs per n-gram).
+
+    :return: (unique rows, total count of each)
+    """
+    if len(ngrams) == 0:
+        return ngrams, counts
+
+    unique, inverse = np.unique(ngrams, axis=0, return_inverse=True)
+    return unique, np.bincount(inverse.ravel(), weights=counts, minlength=len(unique)).astype(np.int64)
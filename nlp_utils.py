@@ -1,6 +1,7 @@
 import nltk
 from nltk.stem.wordnet import WordNetLemmatizer
 from nltk.corpus import wordnet
+from nltk.tokenize import TweetTokenizer
 
 
 def get_pos_list(tokens):
@@ -99,3 +100,37 @@ class MyTokenizer:
             pos_list = get_pos_list(tokens)
             stems = [self.stemmer.stem(word, pos) for word, pos in zip(tokens, pos_list)]
             return stems
+
+
+def make_feature_tokenizer(lemmatize=True, replace_pronouns=True, pronoun_token='simple'):
+    """
+    Set up the tokenizer used for the feature analysis: nltk's TweetTokenizer (with repeated characters shortened),
+    the WordNet lemmatizer, and gendered pronoun replacement. Anything that needs to line up with the feature analysis
+    results (e.g., the comment index) should tokenize with this.
+
+    :param lemmatize: True to lemmatize the tokens with MyLemmatizer
+    :param replace_pronouns: True to replace gendered pronouns (see MyTokenizer)
+    :param pronoun_token: 'simple' or 'detailed' (see MyTokenizer)
+    :return: MyTokenizer object
+    """
+    stemmer = MyLemmatizer() if lemmatize else None
+    return MyTokenizer(tokenizer=TweetTokenizer(reduce_len=True), stemmer=stemmer, replace_pronouns=replace_pronouns,
+                       pronoun_token=pronoun_token)
+
+
+def comment_ngrams(token_lists, ngram_range=(1, 1)):
+    """
+    Get the n-grams of a list of tokenized comments, joined with spaces like CountVectorizer's n-grams. N-grams don't
+    cross from one comment to the next.
+
+    :param token_lists: list of token lists (one per comment)
+    :param ngram_range: (min_n, max_n) n-gram sizes to include
+    :return: list of n-gram strings
+    """
+    min_n, max_n = ngram_range
+    ngrams = []
+    for tokens in token_lists:
+        for n in range(min_n, max_n + 1):
+            ngrams += [' '.join(tokens[i:i + n]) for i in range(len(tokens) - n + 1)]
+
+    return ngrams
@@ -0,0 +1,163 @@
+###
+#
+# Functions for scoring comments with the Google Perspective API and summarizing the scores
+# for each guest. They're used by 03_get_perspective_scores.py and by the workers and merge
+# step in perspective_queue.py.
+#
+###
+
+import sys
+import time
+import numpy as np
+from googleapiclient import discovery
+from googleapiclient.errors import HttpError
+import utils  # utils.py file
+
+
+api_service_name = 'commentanalyzer'
+api_version = 'v1alpha1'
+
+
+def build_apis(key_file=utils.perspective_api_key_file):
+    """
+    Set up a Perspective API service for each API key in the key file. The text file has multiple API keys (from
+    multiple projects) so they can hopefully all be used to speed up the process.
+
+    :param key_file: text file with one or more whitespace-separated API keys
+    :return: list of API services
+    """
+    api_keys = open(key_file).read().split()
+    return [discovery.build(api_service_name, api_version, developerKey=key) for key in api_keys]
+
+
+def compute_perspective_scores(apis, comment_text, which_api=0, retry_rate=0.5, max_tries=0, current_tries=1,
+                               verbose=False):
+    """
+    Compute toxicity and severe toxicity scores of a comment using Google's Perspective API.
+
+    :param apis: list of Perspective API services set up using different API keys
+    :param comment_text: comment text (string)
+    :param which_api: index of of the API service that will be used from apis
+    :param retry_rate: how long to wait before making another API call if it fails
+    :param max_tries: maximum times to retry (set to 0 for no maximum)
+    :param current_tries: the current attempt number
+    :param verbose: if True, print some status messages
+
+    :return: toxicity score, severe toxicity score, and which API number was used
+    """
+
+    # if we've tried too many times, quit and print a message
+    if current_tries > max_tries > 0:
+        sys.exit(f'Maximum tries ({max_tries}) exceeded without success.')
+
+    # select the API out of the list
+    if not isinstance(apis, list):
+        apis = [apis]
+    api = apis[which_api]
+
+    # attempt to get scores from Perspective API; if quota is exceeded, wait and try again with the next API
+    try:
+
+        # max comment length is 20480 -- truncate if it's that long
+        if len(comment_text) > 20480:
+            comment_text = comment_text[:20479]
+
+        analyze_request = {
+            'comment': {'text': comment_text},
+            'requestedAttributes': {'TOXICITY': {}, 'SEVERE_TOXICITY': {}},
+            'languages': ['en']
+        }
+
+        response = api.comments().analyze(body=analyze_request).execute()
+
+        tox_score = response['attributeScores']['TOXICITY']['summaryScore']['value']
+        sev_tox_score = response['attributeScores']['SEVERE_TOXICITY']['summaryScore']['value']
+
+        # return the toxicity score, severe toxicity score, and which API key was used
+        return tox_score, sev_tox_score, which_api
+
+    except HttpError as e:
+        # long comments are already handled above, but sometimes this error is thrown for comments w/ no
+        # readable characters -- skip those
+        if 'Comment text too long' in e._get_reason():
+            return np.nan, np.nan, which_api
+
+        elif verbose and ('Quota exceeded' not in e._get_reason()):
+            print(f'\nOther HttpError -- API {which_api}: {e._get_reason()}')
+
+        time.sleep(retry_rate)
+
+        # retry using the next entry in the API list
+        next_api = (which_api + 1) % len(apis)
+
+        return compute_perspective_scores(apis=apis, comment_text=comment_text, which_api=next_api,
+                                          retry_rate=retry_rate, max_tries=max_tries, current_tries=current_tries+1,
+                                          verbose=verbose)
+
+    # also handle ConnectionResetError -- try again with same API without counting the try
+    except ConnectionResetError as e:
+        time.sleep(retry_rate)
+
+        if verbose:
+            print(f'Handled connection reset error -- API key {which_api}')
+
+        return compute_perspective_scores(apis=apis, comment_text=comment_text, which_api=which_api,
+                                          retry_rate=retry_rate, max_tries=max_tries, current_tries=current_tries,
+                                          verbose=verbose)
+
+
+def add_guest_metrics(guest_df, i, scores, sample_info=None):
+    """
+    Compute the mean and variance of the Perspective scores of a guest's comments (overall and for the last 1000
+    comments in the file) and add them to the guest's row of the dataframe.
+
+    :param guest_df: guest dataframe (updated in place)
+    :param i: index of the guest's row
+    :param scores: dataframe of Perspective scores with one row per comment in the guest's comment file, in order (see
+    score_store.get_comment_scores)
+    :param sample_info: sample info from sampling mode (see 03_get_perspective_scores.py) to only use the sampled
+    comments and record the sample size and confidence intervals (None to use every comment)
+    :return: mean toxicity and mean severe toxicity
+    """
+    # get the average Perspective API scores (only from the sampled comments in sampling mode)
+    if sample_info is not None:
+        sampled = np.array(sample_info['indices'], dtype=int)
+        scores_1000 = scores.iloc[np.sort(sampled[sampled >= len(scores) - 1000])]
+        scores = scores.iloc[sampled]
+    else:
+        scores_1000 = scores.iloc[-1000:]
+
+    tox = scores['perspective_toxicity'].values
+    sev_tox = scores['perspective_severe_toxicity'].values
+    mean_tox = np.nanmean(tox)
+    mean_sev_tox = np.nanmean(sev_tox)
+    var_tox = np.nanvar(tox)
+    var_sev_tox = np.nanvar(sev_tox)
+
+    # get the average scores for the first 1000 comments
+    tox_1000 = scores_1000['perspective_toxicity'].values
+    sev_tox_1000 = scores_1000['perspective_severe_toxicity'].values
+    mean_tox_1000 = np.nanmean(tox_1000)
+    mean_sev_tox_1000 = np.nanmean(sev_tox_1000)
+    var_tox_1000 = np.nanvar(tox_1000)
+    var_sev_tox_1000 = np.nanvar(sev_tox_1000)
+
+    # add the mean scores to the dataframe
+    guest_df.loc[i, 'mean_toxicity'] = mean_tox
+    guest_df.loc[i, 'mean_severe_toxicity'] = mean_sev_tox
+    guest_df.loc[i, 'var_toxicity'] = var_tox
+    guest_df.loc[i, 'var_severe_toxicity'] = var_sev_tox
+    guest_df.loc[i, 'mean_toxicity_1000'] = mean_tox_1000
+    guest_df.loc[i, 'mean_severe_toxicity_1000'] = mean_sev_tox_1000
+    guest_df.loc[i, 'var_toxicity_1000'] = var_tox_1000
+    guest_df.loc[i, 'var_severe_toxicity_1000'] = var_sev_tox_1000
+
+    # record the sample size and confidence intervals in sampling mode
+    if sample_info is not None:
+        guest_df.loc[i, 'toxicity_sample_size'] = len(sample_info['indices'])
+        guest_df.loc[i, 'mean_toxicity_ci_low'], guest_df.loc[i, 'mean_toxicity_ci_high'] = \
+            sample_info['toxicity_ci']
+        guest_df.loc[i, 'mean_severe_toxicity_ci_low'], guest_df.loc[i, 'mean_severe_toxicity_ci_high'] = \
+            sample_info['severe_toxicity_ci']
+
+    return mean_tox, mean_sev_tox
@@ -0,0 +1,464 @@
+###
+#
+# This module splits Perspective API scoring into chunks of comments that several worker
+# processes on one machine can work on at the same time without clobbering each other's
+# files.
+#
+#   python perspective_queue.py populate   # add a chunk for every range of chunk_size comments
+#   python perspective_queue.py work       # run a worker (start as many as the API keys allow)
+#   python perspective_queue.py merge      # fold the finished chunks into the score files and CSV
+#   python perspective_queue.py status     # print the number of chunks in each state
+#
+# The queue is a SQLite database. A worker claims a chunk by taking a lease on it, which it
+# renews while it's scoring. If a worker dies, its lease expires and another worker picks up
+# the chunk. Workers never write to the score files (see score_store.py) or the guest list
+# CSV -- each chunk's scores go to their own JSON file, and the merge step (only one can run
+# at a time) is the only thing that writes the score files and the CSV. Merging can be done
+# at any time and only merges the videos whose chunks are all finished.
+#
+# Note: the queue only works on a single machine. SQLite's locking (and the score file
+# locks, see score_store.py) isn't reliable on network filesystems, so sharing the queue
+# between machines could lose or corrupt work. The queue records the machine that created
+# it and refuses to open on any other. Sampling mode from 03_get_perspective_scores.py
+# isn't supported by the queue.
+#
+###
+
+import json
+import os
+import socket
+import sqlite3
+import sys
+import time
+import numpy as np
+import pandas as pd
+import near_duplicates  # near_duplicates.py file
+import score_store  # score_store.py file
+import utils  # utils.py file
+
+
+## Parameters
+chunk_size = 500  # comments per chunk
+lease_seconds = 600  # how long a worker can hold a chunk without renewing the lease
+poll_seconds = 30  # how long an idle worker waits before checking for expired leases
+score_near_duplicates_once = False  # only score one comment from each near-duplicate cluster (changes the guest means)
+verbose = True
+
+
+class WorkQueue:
+    """
+    Lease-based queue of (video, comment range) chunks stored in a SQLite database. Every change to the queue is a
+    short transaction, so any number of processes on the same machine can use the same database file.
+    """
+    def __init__(self, db_file=utils.perspective_queue_file, timeout=60):
+        """
+        :param db_file: path of the SQLite database file (created if it doesn't exist)
+        :param timeout: how long to wait for another process's transaction to finish, in seconds
+        """
+        self.db_file = db_file
+        self.timeout = timeout
+        with self.transaction() as con:
+            con.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    chunk_id INTEGER PRIMARY KEY,
+                    video_id TEXT NOT NULL,
+                    start INTEGER NOT NULL,
+                    stop INTEGER NOT NULL,
+                    n_comments INTEGER NOT NULL,
+                    status TEXT NOT NULL DEFAULT 'pending',
+                    worker TEXT,
+                    lease_expires REAL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    result_file TEXT,
+                    UNIQUE (video_id, start)
+                )""")
+            con.execute('CREATE TABLE IF NOT EXISTS locks (name TEXT PRIMARY KEY, owner TEXT, expires REAL)')
+            con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+            con.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('host', ?)", (socket.gethostname(),))
+            host = con.execute("SELECT value FROM meta WHERE key = 'host'").fetchone()[0]
+        if host != socket.gethostname():
+            raise RuntimeError(f'The queue in {db_file} was created on {host} -- it can only be used on one machine')
+
+    def transaction(self):
+        """
+        Open a connection with an immediate (write-locked) transaction that's committed when the with block exits.
+        """
+        return Transaction(self.db_file, self.timeout)
+
+    def populate(self, guest_df, chunk_size=500, comment_dir=utils.comment_dir):
+        """
+        Add chunks for every scraped video. Videos that are already in the queue are skipped unless their comment file
+        has a different number of comments (i.e., it was scraped again), in which case their chunks are replaced.
+
+        :param guest_df: guest dataframe (see utils.load_guest_list_file)
+        :param chunk_size: number of comments per chunk
+        :param comment_dir: directory containing the comment JSON files
+        :return: number of chunks added
+        """
+        n_added = 0
+        for _, row in guest_df.iterrows():
+            if (row['video_id'] == '') or (row['done'] not in [1, '1']):
+                continue
+
+            video_id = row['video_id']
+            n_comments = len(json.load(open(os.path.join(comment_dir, f'comments-{video_id}.json'), 'r')))
+
+            with self.transaction() as con:
+                queued = con.execute('SELECT DISTINCT n_comments FROM chunks WHERE video_id = ?', (video_id,)).fetchall()
+                if queued == [(n_comments,)]:
+                    continue
+
+                con.execute('DELETE FROM chunks WHERE video_id = ?', (video_id,))
+                con.executemany('INSERT INTO chunks (video_id, start, stop, n_comments) VALUES (?, ?, ?, ?)',
+                                [(video_id, start, min(start + chunk_size, n_comments), n_comments)
+                                 for start in range(0, n_comments, chunk_size)])
+                n_added += len(range(0, n_comments, chunk_size))
+
+        return n_added
+
+    def claim(self, worker, lease_seconds=600):
+        """
+        Lease the next chunk that's pending or whose lease has expired.
+
+        :param worker: worker ID
+        :param lease_seconds: length of the lease
+        :return: dictionary with the chunk's columns (None if there's nothing to claim)
+        """
+        now = time.time()
+        with self.transaction() as con:
+            row = con.execute("""
+                SELECT chunk_id, video_id, start, stop, n_comments FROM chunks
+                WHERE status = 'pending' OR (status = 'leased' AND lease_expires < ?)
+                ORDER BY chunk_id LIMIT 1""", (now,)).fetchone()
+            if row is None:
+                return None
+
+            con.execute("""
+                UPDATE chunks SET status = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE chunk_id = ?""", (worker, now + lease_seconds, row[0]))
+
+        return dict(zip(['chunk_id', 'video_id', 'start', 'stop', 'n_comments'], row))
+
+    def renew(self, chunk_id, worker, lease_seconds=600):
+        """
+        Extend a lease. Returns False if the worker doesn't hold the lease anymore (it expired and another worker
+        claimed the chunk), in which case the worker should give up on the chunk.
+        """
+        with self.transaction() as con:
+            cursor = con.execute("""
+                UPDATE chunks SET lease_expires = ?
+                WHERE chunk_id = ? AND worker = ? AND status = 'leased'""", (time.time() + lease_seconds, chunk_id,
+                                                                            worker))
+        return cursor.rowcount == 1
+
+    def finish(self, chunk_id, worker, status='done', result_file=None):
+        """
+        Mark a leased chunk as 'done' (with its result file) or 'stale' (comment file changed since the chunk was
+        queued). Returns False if the worker doesn't hold the lease anymore.
+        """
+        with self.transaction() as con:
+            cursor = con.execute("""
+                UPDATE chunks SET status = ?, result_file = ?, lease_expires = NULL
+                WHERE chunk_id = ? AND worker = ? AND status = 'leased'""", (status, result_file, chunk_id, worker))
+        return cursor.rowcount == 1
+
+    def mark_merged(self, video_id):
+        with self.transaction() as con:
+            con.execute("UPDATE chunks SET status = 'merged' WHERE video_id = ? AND status = 'done'", (video_id,))
+
+    def chunks(self, video_id=None):
+        """
+        Get every chunk (or every chunk of a video) as a list of dictionaries.
+        """
+        with self.transaction() as con:
+            cursor = con.execute('SELECT * FROM chunks' + (' WHERE video_id = ?' if video_id is not None else '') +
+                                 ' ORDER BY video_id, start', (video_id,) if video_id is not None else ())
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def status(self):
+        """
+        Count the chunks in each state: pending, leased, done (scored but not merged), merged, and stale.
+        """
+        with self.transaction() as con:
+            return dict(con.execute('SELECT status, COUNT(*) FROM chunks GROUP BY status').fetchall())
+
+    def acquire_lock(self, name, owner, lease_seconds=600):
+        """
+        Take a named lock (e.g., so only one merge runs at a time). Returns False if someone else holds it.
+        """
+        now = time.time()
+        with self.transaction() as con:
+            row = con.execute('SELECT owner, expires FROM locks WHERE name = ?', (name,)).fetchone()
+            if row is not None and row[0] != owner and row[1] > now:
+                return False
+            con.execute('INSERT OR REPLACE INTO locks (name, owner, expires) VALUES (?, ?, ?)',
+                        (name, owner, now + lease_seconds))
+        return True
+
+    def release_lock(self, name, owner):
+        with self.transaction() as con:
+            con.execute('DELETE FROM locks WHERE name = ? AND owner = ?', (name, owner))
+
+
+class Transaction:
+    """
+    Context manager for a SQLite connection with an immediate transaction, so reading and updating a chunk can't be
+    interleaved with another process doing the same.
+    """
+    def __init__(self, db_file, timeout):
+        self.con = sqlite3.connect(db_file, timeout=timeout, isolation_level=None)
+
+    def __enter__(self):
+        self.con.execute('BEGIN IMMEDIATE')
+        return self.con
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.con.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+        self.con.close()
+
+
+def worker_id():
+    """
+    ID of this worker process.
+    """
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+def load_representatives(cluster_df, video_id, comments):
+    """
+    Get whether each comment of a video is the representative of its near-duplicate cluster (None if there are no
+    clusters). See near_duplicates.representative_mask.
+    """
+    if cluster_df is None:
+        return None
+
+    return near_duplicates.representative_mask(cluster_df, video_id, comments)
+
+
+def score_chunk(queue, chunk, worker, apis, which_api=0, cluster_df=None, result_dir=utils.perspective_chunk_dir,
+                comment_dir=utils.comment_dir, lease_seconds=600, verbose=True):
+    """
+    Score the comments in a chunk that don't have scores yet and write every score in the chunk's comment range
+    (including ones that were already in the score file) to the chunk's result file. Near duplicates are skipped
+    (the merge step copies the scores of their cluster's representative).
+
+    :param queue: WorkQueue
+    :param chunk: chunk dictionary from WorkQueue.claim
+    :param worker: worker ID
+    :param apis: list of Perspective API services (see perspective.build_apis)
+    :param which_api: which API from the list to use first
+    :param cluster_df: near-duplicate cluster dataframe (None to score every comment)
+    :param result_dir: directory for the chunk result files
+    :param comment_dir: directory containing the comment JSON files
+    :param lease_seconds: length of the lease (it's renewed before an API call once a third of it has passed)
+    :param verbose: if True, print some status messages
+    :return: the API that was used last
+    """
+    import perspective  # perspective.py file -- imported here so the queue can be managed without the API client
+
+    video_id, start, stop = chunk['video_id'], chunk['start'], chunk['stop']
+    comments = json.load(open(os.path.join(comment_dir, f'comments-{video_id}.json'), 'r'))
+
+    # the comment file was scraped again after the chunk was queued
+    if len(comments) != chunk['n_comments']:
+        queue.finish(chunk['chunk_id'], worker, status='stale')
+        if verbose:
+            print(f'comment file for {video_id} changed since it was queued -- run populate again', flush=True)
+        return which_api
+
+    representatives = load_representatives(cluster_df, video_id, comments)
+    ids = score_store.comment_ids(comments)
+    existing = score_store.load_scores(video_id, 'perspective')
+    scores = []
+    n_scored = 0
+    last_renewal = time.time()
+    for j in range(start, stop):
+        comment = comments[j]
+        if 'commentText' not in comment:
+            continue
+
+        if ids[j] in existing.index:
+            tox_score, sev_tox_score = existing.loc[ids[j], ['perspective_toxicity', 'perspective_severe_toxicity']]
+        else:
+            if representatives is not None and not representatives[j]:
+                continue
+
+            # renew the lease based on time (API calls can take a long time when the quota runs out), and give up on
+            # the chunk if another worker took it over
+            if time.time() - last_renewal > lease_seconds / 3:
+                if not queue.renew(chunk['chunk_id'], worker, lease_seconds):
+                    if verbose:
+                        print(f'lost the lease on chunk {chunk["chunk_id"]} -- skipping it', flush=True)
+                    return which_api
+                last_renewal = time.time()
+
+            tox_score, sev_tox_score, which_api = perspective.compute_perspective_scores(
+                apis=apis, comment_text=comment['commentText'], which_api=which_api, verbose=verbose)
+            n_scored += 1
+
+        scores.append([j, ids[j], tox_score, sev_tox_score])
+
+    # write the result file under a temporary name first so the merge step never sees a partial file
+    os.makedirs(result_dir, exist_ok=True)
+    result_file = os.path.join(result_dir, f'{video_id}-{start}-{stop}.json')
+    with open(f'{result_file}.{worker}.tmp', 'w') as f:
+        json.dump({'video_id': video_id, 'start': start, 'stop': stop, 'n_comments': len(comments), 'scores': scores},
+                  f)
+    os.replace(f'{result_file}.{worker}.tmp', result_file)
+
+    if queue.finish(chunk['chunk_id'], worker, result_file=result_file) and verbose:
+        print(f'finished chunk {chunk["chunk_id"]} ({video_id} comments {start}-{stop}) -- scored {n_scored}',
+              flush=True)
+
+    return which_api
+
+
+def run_worker(queue, apis, cluster_df=None, lease_seconds=600, poll_seconds=30, verbose=True):
+    """
+    Claim and score chunks until every chunk is finished. When there's nothing to claim but other workers still hold
+    leases, wait in case one of them expires.
+    """
+    worker = worker_id()
+    which_api = 0
+    while True:
+        chunk = queue.claim(worker, lease_seconds)
+        if chunk is None:
+            if queue.status().get('leased', 0) == 0:
+                break
+            time.sleep(poll_seconds)
+            continue
+
+        which_api = score_chunk(queue, chunk, worker, apis, which_api=which_api, cluster_df=cluster_df,
+                                lease_seconds=lease_seconds, verbose=verbose)
+        which_api = (which_api + 1) % len(apis)
+
+    if verbose:
+        print(f'worker {worker} done -- {queue.status()}', flush=True)
+
+
+def merge_results(queue, guest_df, cluster_df=None, comment_dir=utils.comment_dir, lock_seconds=600, verbose=True):
+    """
+    Fold the finished chunks into the score files and add the guest metrics to the guest list CSV file. A video is
+    merged once all of its chunks are done. Near duplicates get the scores of their cluster's representative, which can
+    be in another video -- if that representative hasn't been scored yet, the video waits for a later merge (unless
+    the queue is finished).
+
+    :param queue: WorkQueue
+    :param guest_df: guest dataframe (see utils.load_guest_list_file) -- updated and saved
+    :param cluster_df: near-duplicate cluster dataframe (None if near duplicates were scored too)
+    :param comment_dir: directory containing the comment JSON files
+    :param lock_seconds: length of the merge lock's lease (it's renewed before each video is written)
+    :param verbose: if True, print some status messages
+    :return: list of merged video IDs
+    """
+    import perspective  # perspective.py file
+
+    owner = worker_id()
+    if not queue.acquire_lock('merge', owner, lock_seconds):
+        raise RuntimeError('Another merge is already running')
+
+    try:
+        chunks = queue.chunks()
+        queue_finished = all(chunk['status'] in ['done', 'merged', 'stale'] for chunk in chunks)
+
+        # scores of each near-duplicate cluster from every finished chunk
+        results = {}
+        cluster_scores = {}
+        for chunk in chunks:
+            if chunk['status'] not in ['done', 'merged']:
+                continue
+            result = json.load(open(chunk['result_file'], 'r'))
+            results[chunk['chunk_id']] = result
+            if cluster_df is not None:
+                video_clusters = cluster_df[cluster_df['video_id'] == chunk['video_id']]
+                clusters = dict(zip(video_clusters['comment_id'], video_clusters['cluster_id']))
+                for _, comment_id, tox, sev_tox in result['scores']:
+                    if comment_id in clusters and tox is not None and not np.isnan(tox):
+                        cluster_scores[clusters[comment_id]] = (tox, sev_tox)
+
+        merged = []
+        for video_id in sorted(set(chunk['video_id'] for chunk in chunks)):
+            video_chunks = [chunk for chunk in chunks if chunk['video_id'] == video_id]
+            if any(chunk['status'] != 'done' for chunk in video_chunks):
+                continue
+
+            comments = json.load(open(os.path.join(comment_dir, f'comments-{video_id}.json'), 'r'))
+            if len(comments) != video_chunks[0]['n_comments']:
+                if verbose:
+                    print(f'comment file for {video_id} changed since it was queued -- run populate again')
+                continue
+
+            # copy the scores from the chunk results (checking the comment IDs in case the file was replaced)
+            ids = score_store.comment_ids(comments)
+            scores = {}
+            for chunk in video_chunks:
+                for j, comment_id, tox, sev_tox in results[chunk['chunk_id']]['scores']:
+                    if ids[j] != comment_id:
+                        raise ValueError(f'comment {j} of {video_id} does not match the chunk results')
+                    scores[comment_id] = (tox, sev_tox)
+
+            # fill in the near duplicates from their clusters
+            clusters = near_duplicates.get_video_clusters(cluster_df, video_id, comments) \
+                if cluster_df is not None else None
+            missing = False
+            for j, comment in enumerate(comments):
+                if ('commentText' in comment) and (ids[j] not in scores):
+                    if clusters is not None and clusters[j] in cluster_scores:
+                        scores[ids[j]] = cluster_scores[clusters[j]]
+                    else:
+                        missing = True
+
+            if missing and not queue_finished:
+                if verbose:
+                    print(f'waiting for near-duplicate scores from other videos before merging {video_id}')
+                continue
+
+            # renew the merge lock before writing anything, and stop if another merge took it over
+            if not queue.acquire_lock('merge', owner, lock_seconds):
+                if verbose:
+                    print(f'lost the merge lock before merging {video_id} -- stopping', flush=True)
+                break
+
+            scores_df = pd.DataFrame(list(scores.values()), index=pd.Index(list(scores), name='id'),
+                                     columns=['perspective_toxicity', 'perspective_severe_toxicity'], dtype=float)
+            score_store.update_scores(video_id, 'perspective', scores_df)
+
+            i = guest_df.index[guest_df['video_id'] == video_id][0]
+            mean_tox, mean_sev_tox = perspective.add_guest_metrics(
+                guest_df, i, score_store.get_comment_scores(video_id, 'perspective', comments))
+            utils.save_guest_list_file(guest_df)
+            queue.mark_merged(video_id)
+            merged.append(video_id)
+
+            if verbose:
+                print(f"merged {guest_df.loc[i, 'guest']} -- mean_tox = {round(mean_tox, 3)}, "
+                      f"mean_sev_tox = {round(mean_sev_tox, 3)}", flush=True)
+    finally:
+        queue.release_lock('merge', owner)
+
+    return merged
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'status'
+    work_queue = WorkQueue()
+
+    cluster_df = None
+    if score_near_duplicates_once and command in ['work', 'merge']:
+        cluster_df = near_duplicates.load_clusters() if os.path.isfile(utils.near_duplicate_file) else None
+
+    if command == 'populate':
+        print(f'added {work_queue.populate(utils.load_guest_list_file(), chunk_size)} chunks')
+    elif command == 'work':
+        import perspective  # perspective.py file
+        run_worker(work_queue, perspective.build_apis(), cluster_df=cluster_df, lease_seconds=lease_seconds,
+                   poll_seconds=poll_seconds, verbose=verbose)
+    elif command == 'merge':
+        merged_videos = merge_results(work_queue, utils.load_guest_list_file(), cluster_df=cluster_df,
+                                      lock_seconds=lease_seconds, verbose=verbose)
+        print(f'merged {len(merged_videos)} videos')
+    elif command != 'status':
+        sys.exit(f'unknown command: {command} (use populate, work, merge, or status)')
+
+    print(work_queue.status())
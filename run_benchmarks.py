@@ -0,0 +1,223 @@
+###
+#
+# This script benchmarks the slow parts of the analysis (tokenizing, VADER scoring, name
+# scrubbing, n-gram counting, and the Dirichlet model) on synthetic comment data. The
+# corpus is generated deterministically by synthetic_data.py, so results are comparable
+# between runs and machines as long as the parameters below stay the same.
+#
+# Each benchmark reports run time, throughput, and peak memory use, and compares them to
+# the results stored in the baseline file. No baseline is included (the results depend on
+# the machine), so set update_baseline = True to record one on your machine first, and
+# again after an intentional change. Comments are read one video at a time, so corpora with
+# tens of millions of comments can be benchmarked.
+#
+###
+
+import itertools
+import json
+import os
+import time
+import tracemalloc
+from datetime import datetime
+import numpy as np
+import synthetic_data
+import utils  # utils.py file
+
+
+## Parameters
+scales = [10000]  # number of comments in the synthetic corpus -- e.g., [10000, 1000000, 10000000]
+n_guests = 100
+vocab_size = 50000
+rounds = 3  # number of timed runs of each benchmark (the fastest one is reported)
+benchmarks_to_run = ['tokenize', 'tokenize_lemmatize', 'vader', 'vader_batch', 'scrub_names', 'dirichlet_model',
+                     'sparse_dirichlet_model', 'sketch_ngrams']
+corpus_dir = os.path.join(utils.benchmark_dir, 'corpus')
+baseline_file = os.path.join(utils.benchmark_dir, 'baseline.json')
+update_baseline = False
+regression_threshold = 0.1  # flag benchmarks that are this much slower than the baseline (0.1 = 10%)
+
+
+def run_benchmark(func, setup=None, n_items=1, rounds=3, videos=None):
+    """
+    Time a function similar to the way pytest-benchmark does: run it several times and keep the fastest time. Peak
+    memory is measured on a separate run with tracemalloc (which slows things down, so it isn't timed).
+
+    Benchmarks that process comments can run one video at a time (pass videos), so the whole corpus is never in memory
+    at once. The function is called once per video and its times are added up -- reading the comment files and setup
+    aren't timed -- and the peak memory is the largest peak of a single call.
+
+    :param func: function to benchmark -- called with the output of setup (if given) or no arguments, or once per video
+    with the output of setup(row, comments) (if given) or the list of comments when videos is given
+    :param setup: function that returns the argument for func -- called before every run (or video) and not timed
+    :param n_items: number of items (e.g., comments) processed per run, used to compute throughput
+    :param rounds: number of timed runs
+    :param videos: function with no arguments that returns a generator of (guest list row, list of comment strings)
+    for each video (see synthetic_data.iter_corpus_text), or None to call func once per run
+    :return: dictionary of results
+    """
+    def get_args(*video):
+        if video:
+            return (setup(*video),) if setup is not None else (video[1],)
+        return (setup(),) if setup is not None else ()
+
+    times = []
+    for _ in range(rounds):
+        seconds = 0.0
+        for video in (videos() if videos is not None else [()]):
+            args = get_args(*video)
+            start = time.perf_counter()
+            func(*args)
+            seconds += time.perf_counter() - start
+        times.append(seconds)
+
+    tracemalloc.start()
+    peak_memory = 0
+    for video in (videos() if videos is not None else [()]):
+        args = get_args(*video)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(*args)
+        peak_memory = max(peak_memory, tracemalloc.get_traced_memory()[1] - (current if videos is not None else 0))
+    tracemalloc.stop()
+
+    return {
+        'min_seconds': min(times),
+        'mean_seconds': float(np.mean(times)),
+        'items_per_second': n_items / min(times),
+        'peak_memory_mb': peak_memory / 2 ** 20,
+        'n_items': n_items,
+        'rounds': rounds,
+    }
+
+
+def compare_to_baseline(name, result, baseline, threshold=0.1):
+    """
+    Format a line of output comparing a benchmark result to the baseline result (if there is one).
+    """
+    out = f"{name:<36} {result['min_seconds']:>9.3f} s {result['items_per_second']:>12,.0f} items/s"
+    out += f" {result['peak_memory_mb']:>9.1f} MB"
+
+    if name in baseline:
+        time_change = result['min_seconds'] / baseline[name]['min_seconds'] - 1
+        memory_change = result['peak_memory_mb'] / max(baseline[name]['peak_memory_mb'], 1e-9) - 1
+        out += f"   time {time_change:+.1%}, memory {memory_change:+.1%}"
+        if time_change > threshold:
+            out += '   <-- SLOWER'
+    else:
+        out += '   (no baseline)'
+
+    return out
+
+
+def get_benchmarks(guest_df, scale_dir):
+    """
+    Set up the benchmarks for one corpus. Imports are done here so only the packages needed by the selected benchmarks
+    get loaded. Comments are read one video at a time, so large corpora never have to fit in memory.
+
+    :param guest_df: synthetic guest list dataframe
+    :param scale_dir: directory containing the synthetic corpus
+    :return: dictionary of benchmark name -> (function, setup function, number of items, videos function or None) --
+    see run_benchmark
+    """
+    def videos(df=guest_df):
+        return synthetic_data.iter_corpus_text(scale_dir, df)
+
+    n_comments = int(guest_df['n_comments'].astype(int).sum())
+    benchmarks = {}
+
+    if 'tokenize' in benchmarks_to_run or 'tokenize_lemmatize' in benchmarks_to_run:
+        import nlp_utils as nlp
+
+        simple_tokenizer = nlp.make_feature_tokenizer(lemmatize=False)
+        benchmarks['tokenize'] = (lambda comments: [simple_tokenizer.tokenize(c.lower()) for c in comments],
+                                  None, n_comments, videos)
+
+        lemma_tokenizer = nlp.make_feature_tokenizer(lemmatize=True)
+        benchmarks['tokenize_lemmatize'] = (lambda comments: [lemma_tokenizer.tokenize(c.lower()) for c in comments],
+                                            None, n_comments, videos)
+
+    if 'vader' in benchmarks_to_run:
+        from nltk.sentiment.vader import SentimentIntensityAnalyzer
+
+        sia = SentimentIntensityAnalyzer()
+        benchmarks['vader'] = (lambda comments: [sia.polarity_scores(c)['compound'] for c in comments],
+                               None, n_comments, videos)
+
+    if 'vader_batch' in benchmarks_to_run:
+        import batch_vader
+
+        batch_sia = batch_vader.BatchSentimentAnalyzer()
+        sample = list(itertools.islice((c for _, comments in videos() for c in comments), 10000))
+        difference = batch_vader.compare_to_nltk(sample, batch_sia)
+        if difference > 1e-9:
+            print(f'WARNING: batch VADER scores differ from nltk by up to {difference}')
+        benchmarks['vader_batch'] = (batch_sia.compound_scores, None, n_comments, videos)
+
+    if 'scrub_names' in benchmarks_to_run:
+        def one_guest_df(row, comments):
+            return row.to_frame().T.assign(comments=' '.join(comments))
+
+        benchmarks['scrub_names'] = (utils.scrub_names, one_guest_df, n_comments, videos)
+
+    if 'dirichlet_model' in benchmarks_to_run or 'sparse_dirichlet_model' in benchmarks_to_run:
+        from scipy.sparse import csr_matrix
+        from sklearn.feature_extraction.text import CountVectorizer
+        from models import multinomial_dirichlet_model, sparse_multinomial_dirichlet_model
+
+        # count the words and bigrams of each video, then add up the counts for each female_flag group
+        cv = CountVectorizer(token_pattern=r'\S+', ngram_range=(1, 2))
+        video_counts = cv.fit_transform(' '.join(comments) for _, comments in videos())
+        labels = guest_df['female_flag'].values
+        groups = csr_matrix((labels[None, :] == np.unique(labels)[:, None]).astype(np.int64))
+        counts = (groups @ video_counts).tocsr()
+        feature_names = cv.get_feature_names()
+        benchmarks['dirichlet_model'] = (lambda: multinomial_dirichlet_model(counts, feature_names=feature_names),
+                                         None, counts.shape[1], None)
+        benchmarks['sparse_dirichlet_model'] = (
+            lambda: sparse_multinomial_dirichlet_model(counts, feature_names=feature_names, top_k=1000),
+            None, counts.shape[1], None)
+
+    if 'sketch_ngrams' in benchmarks_to_run:
+        from ngram_counter import SketchNgramCounter
+
+        # each group's comments are streamed from the comment files, so this one includes the time to read them
+        def group_documents():
+            return [(c for _, comments in videos(df) for c in comments) for _, df in guest_df.groupby('female_flag')]
+
+        counter = SketchNgramCounter(tokenizer=str.split, ngram_range=(1, 4), min_count=5)
+        benchmarks['sketch_ngrams'] = (counter.fit_transform, group_documents, n_comments, None)
+
+    return {name: benchmarks[name] for name in benchmarks_to_run if name in benchmarks}
+
+
+if __name__ == '__main__':
+    baseline = json.load(open(baseline_file, 'r')) if os.path.isfile(baseline_file) else {}
+    results = {}
+
+    print(f'starting at {datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")}', flush=True)
+
+    for scale in scales:
+        # generate the corpus if it doesn't exist yet
+        scale_dir = os.path.join(corpus_dir, f'{scale}')
+        guest_file = os.path.join(scale_dir, 'guest_list.csv')
+        if not os.path.isfile(guest_file):
+            print(f'generating synthetic corpus with {scale:,} comments', flush=True)
+            synthetic_data.generate_corpus(scale_dir, n_comments=scale, n_guests=n_guests, vocab_size=vocab_size)
+        guest_df = utils.load_guest_list_file(guest_file)
+
+        print(f'\n{scale:,} comments', flush=True)
+        for name, (func, setup, n_items, videos) in get_benchmarks(guest_df, scale_dir).items():
+            key = f'{name}[{scale}]'
+            results[key] = run_benchmark(func, setup=setup, n_items=n_items, rounds=rounds, videos=videos)
+            print(compare_to_baseline(key, results[key], baseline, regression_threshold), flush=True)
+
+    if update_baseline:
+        baseline.update(results)
+        os.makedirs(os.path.dirname(baseline_file), exist_ok=True)
+        with open(baseline_file, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'\nsaved baseline to {baseline_file}')
+    elif not baseline:
+        print(f'\nno baseline in {baseline_file} -- set update_baseline = True to save these results as the baseline')
+
+    print(f'finished at {datetime.now().strftime("%Y-%m-%d %I:%M:%S %p")}')
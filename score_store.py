@@ -0,0 +1,244 @@
+###
+#
+# This module stores the scores computed for each comment (VADER sentiment, Perspective
+# toxicity, ...) in sidecar files next to the raw comment files instead of adding them to
+# the comment JSON. The raw files from 01_scrape_comments.py are never modified, so
+# rescraping a video doesn't lose any scores, and only comments with new IDs need scoring.
+#
+# Each scorer has its own directory with one file per video:
+#   scores/{scorer}/{video_id}.npz           comment IDs and a float array for each score
+#   scores/{scorer}/{video_id}.pending.jsonl scores added since the .npz file was written
+#   scores/{scorer}/{video_id}.lock          lock file (see video_lock)
+#
+# Scores are appended to the .pending.jsonl file while a video is being scored (a few bytes
+# per comment) and folded into the .npz file when it's done. Every write takes the video's
+# lock, so scores appended by one process while another one folds them (e.g., 03 and
+# perspective_queue.py merge) aren't lost. The lock is an flock, so the score directory
+# should be on a local filesystem.
+#
+# Run `python score_store.py` once to copy the scores already in the comment JSON files
+# into sidecar files (the comment files aren't changed).
+#
+###
+
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+import utils  # utils.py file
+
+
+# score columns written by each scorer
+scorer_columns = {
+    'sentiment': ['sentiment_score'],
+    'perspective': ['perspective_toxicity', 'perspective_severe_toxicity'],
+}
+
+
+def comment_ids(comments):
+    """
+    Get the ID of each comment in a comment file. Comments without a YouTube ID get one made from their content (see
+    content_id), never their position, so scores can't attach to a different comment after a rescrape.
+    """
+    return [comment['id'] if comment.get('id') else content_id(comment) for comment in comments]
+
+
+def content_id(comment):
+    """
+    Make a stable ID for a comment from a hash of its author and text. The scraper's time fields are relative to when
+    the video was scraped ('3 weeks ago'), so they aren't used. Comments with the same author and text get the same ID,
+    which is fine because they get the same scores.
+    """
+    key = json.dumps([comment.get('author', ''), comment.get('commentText', '')])
+    return 'sha1-' + hashlib.sha1(key.encode('utf-8')).hexdigest()[:20]
+
+
+def score_file(video_id, scorer, score_dir=utils.score_dir):
+    return os.path.join(score_dir, scorer, f'{video_id}.npz')
+
+
+def pending_file(video_id, scorer, score_dir=utils.score_dir):
+    return os.path.join(score_dir, scorer, f'{video_id}.pending.jsonl')
+
+
+def lock_file(video_id, scorer, score_dir=utils.score_dir):
+    return os.path.join(score_dir, scorer, f'{video_id}.lock')
+
+
+@contextlib.contextmanager
+def video_lock(video_id, scorer, score_dir=utils.score_dir):
+    """
+    Hold an exclusive lock on a video's score files for the duration of a with block. The lock is released if the
+    process dies. It isn't reentrant, so don't call the functions below that take it while holding it.
+    """
+    file = lock_file(video_id, scorer, score_dir)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load_scores(video_id, scorer, score_dir=utils.score_dir):
+    """
+    Load the scores of a video, including scores that haven't been folded into the .npz file yet.
+
+    :param video_id: YouTube video ID
+    :param scorer: scorer name (see scorer_columns)
+    :param score_dir: directory containing the score files
+    :return: dataframe of scores indexed by comment ID (empty if the video hasn't been scored)
+    """
+    columns = scorer_columns[scorer]
+    df = pd.DataFrame(columns=columns, index=pd.Index([], name='id'), dtype=float)
+    pending = df
+
+    # read the pending scores before the .npz file: a fold that happens in between replaces the .npz file before it
+    # removes the pending file, so every score is in one or the other
+    records = []
+    try:
+        with open(pending_file(video_id, scorer, score_dir), 'r') as f:
+            for line in f:
+                # a line can be incomplete if the process was killed while writing it -- skip it and keep the rest
+                try:
+                    records.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    if records:
+        pending = pd.DataFrame(records).set_index('id')[columns].astype(float)
+
+    file = score_file(video_id, scorer, score_dir)
+    if os.path.isfile(file):
+        with np.load(file) as data:
+            df = pd.DataFrame({column: data[column] for column in columns}, index=pd.Index(data['id'], name='id'))
+
+    df = pd.concat([df, pending])
+    return df[~df.index.duplicated(keep='last')]
+
+
+def save_scores(video_id, scorer, df, score_dir=utils.score_dir):
+    """
+    Write the scores of a video to its .npz file (replacing it) and remove its pending scores. Hold the video's lock
+    (see video_lock) from loading the scores that df is based on until this returns -- otherwise scores appended in
+    between are deleted with the pending file. update_scores and compact_scores do that.
+
+    :param video_id: YouTube video ID
+    :param scorer: scorer name (see scorer_columns)
+    :param df: dataframe of scores indexed by comment ID with the scorer's columns
+    :param score_dir: directory containing the score files
+    """
+    file = score_file(video_id, scorer, score_dir)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    df = df[~df.index.duplicated(keep='last')]
+
+    # write to a temporary file first so an interrupted write doesn't leave a broken file
+    with open(f'{file}.tmp', 'wb') as f:
+        np.savez(f, id=np.array(df.index, dtype=str),
+                 **{column: df[column].values.astype(np.float64) for column in scorer_columns[scorer]})
+    os.replace(f'{file}.tmp', file)
+
+    if os.path.isfile(pending_file(video_id, scorer, score_dir)):
+        os.remove(pending_file(video_id, scorer, score_dir))
+
+
+def append_scores(video_id, scorer, ids, scores, score_dir=utils.score_dir):
+    """
+    Add scores for some comments of a video without rewriting its .npz file.
+
+    :param video_id: YouTube video ID
+    :param scorer: scorer name (see scorer_columns)
+    :param ids: list of comment IDs
+    :param scores: dictionary of column -> list of scores (same order as ids)
+    :param score_dir: directory containing the score files
+    """
+    file = pending_file(video_id, scorer, score_dir)
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with video_lock(video_id, scorer, score_dir):
+        # start a new line if the last write was interrupted partway through a line
+        torn = False
+        if os.path.isfile(file) and os.path.getsize(file) > 0:
+            with open(file, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                torn = f.read(1) != b'\n'
+
+        with open(file, 'a') as f:
+            if torn:
+                f.write('\n')
+            for k, comment_id in enumerate(ids):
+                record = {'id': comment_id}
+                record.update({column: scores[column][k] for column in scorer_columns[scorer]})
+                f.write(json.dumps(record) + '\n')
+
+
+def update_scores(video_id, scorer, df, score_dir=utils.score_dir, keep_existing=False):
+    """
+    Add scores for some comments of a video to its .npz file, folding in its pending scores too.
+
+    :param video_id: YouTube video ID
+    :param scorer: scorer name (see scorer_columns)
+    :param df: dataframe of scores indexed by comment ID with the scorer's columns
+    :param score_dir: directory containing the score files
+    :param keep_existing: if True, comments that already have scores keep them; otherwise df replaces them
+    """
+    with video_lock(video_id, scorer, score_dir):
+        existing = load_scores(video_id, scorer, score_dir)
+        save_scores(video_id, scorer, pd.concat([df, existing] if keep_existing else [existing, df]), score_dir)
+
+
+def compact_scores(video_id, scorer, score_dir=utils.score_dir):
+    """
+    Fold a video's pending scores into its .npz file.
+    """
+    with video_lock(video_id, scorer, score_dir):
+        if os.path.isfile(pending_file(video_id, scorer, score_dir)):
+            save_scores(video_id, scorer, load_scores(video_id, scorer, score_dir), score_dir)
+
+
+def get_comment_scores(video_id, scorer, comments, score_dir=utils.score_dir):
+    """
+    Line up the scores of a video with its comments.
+
+    :param video_id: YouTube video ID
+    :param scorer: scorer name (see scorer_columns)
+    :param comments: list of comment dictionaries from the video's comment file
+    :param score_dir: directory containing the score files
+    :return: dataframe with one row per comment, in the same order as the comment file (NaN for unscored comments)
+    """
+    df = load_scores(video_id, scorer, score_dir).reindex(comment_ids(comments))
+    return df.reset_index(drop=True)
+
+
+def migrate_comment_file(video_id, comment_dir=utils.comment_dir, score_dir=utils.score_dir):
+    """
+    Copy the scores stored in a comment JSON file by earlier versions of the scoring scripts into sidecar files
+    (scores already in the sidecar files are kept).
+
+    :return: dictionary of scorer -> number of comments with scores in the JSON file
+    """
+    comments = json.load(open(os.path.join(comment_dir, f'comments-{video_id}.json'), 'r'))
+    ids = comment_ids(comments)
+    n_migrated = {}
+
+    for scorer, columns in scorer_columns.items():
+        scored = [j for j, comment in enumerate(comments) if all(column in comment for column in columns)]
+        if not scored:
+            continue
+
+        df = pd.DataFrame({column: [comments[j][column] for j in scored] for column in columns},
+                          index=pd.Index([ids[j] for j in scored], name='id'), dtype=float)
+        update_scores(video_id, scorer, df, score_dir, keep_existing=True)
+        n_migrated[scorer] = len(scored)
+
+    return n_migrated
+
+
+if __name__ == '__main__':
+    for _, row in utils.load_guest_list_file().iterrows():
+        if (row['video_id'] != '') and (row['done'] in [1, '1']):
+            print(f"{row['guest']}: {migrate_comment_file(row['video_id'])}", flush=True)
@@ -0,0 +1,270 @@
+###
+#
+# This module runs a local scoring server that keeps the VADER sentiment analyzer and the
+# tokenizer/lemmatizer loaded in memory, so scoring a few comments doesn't mean waiting
+# for nltk, the VADER lexicon, WordNet, and the POS tagger to load every time.
+#
+# Start the server in a separate terminal with `python scoring_server.py` and stop it with
+# Ctrl-C. The sentiment_scores and tokenize functions below use the server if it's running
+# and fall back to loading everything locally if it isn't, so scripts work either way.
+#
+# Requests and responses are JSON objects, one per line, sent over a Unix socket.
+#
+###
+
+import json
+import os
+import socket
+import socketserver
+import threading
+import utils  # utils.py file
+
+
+# models loaded in this process when the server isn't running (so they're only loaded once per session)
+local_models = {}
+
+
+def load_sentiment_analyzer():
+    """
+    Load the VADER sentiment analyzer from nltk.
+    """
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    return SentimentIntensityAnalyzer()
+
+
+def load_tokenizer(**options):
+    """
+    Set up a MyTokenizer object with the same tokenizer settings used by the feature analysis script (see
+    nlp_utils.make_feature_tokenizer for the options).
+    """
+    import nlp_utils as nlp
+    return nlp.make_feature_tokenizer(**options)
+
+
+def get_tokenizer(models, **options):
+    """
+    Get a tokenizer with the given options from a dictionary of loaded models, loading it if needed.
+    """
+    key = ('tokenizer',) + tuple(sorted(options.items()))
+    if key not in models:
+        models[key] = load_tokenizer(**options)
+
+    return models[key]
+
+
+def handle_request(models, request):
+    """
+    Process a single request using the loaded models. The server and the local fallback both use this function, so
+    they always return the same results.
+
+    Supported operations:
+      - {'op': 'sentiment', 'texts': [...], 'full': False, 'engine': 'batch'}: compound VADER score for each text (or
+        the full polarity_scores dictionary if 'full' is True), computed with BatchSentimentAnalyzer if engine is
+        'batch' or with nltk's SentimentIntensityAnalyzer if it's 'nltk' (both give the same compound scores)
+      - {'op': 'tokenize', 'texts': [...], 'options': {...}}: list of tokens for each text, where the options are
+        passed to load_tokenizer (plus 'lowercase', default True, which lowercases the text first like CountVectorizer)
+      - {'op': 'ping'}: returns 'pong'
+
+    :param models: dictionary of loaded models (models that aren't loaded yet are added to it)
+    :param request: request dictionary
+    :return: result of the request
+    """
+    op = request.get('op')
+
+    if op == 'sentiment':
+        if 'sia' not in models:
+            models['sia'] = load_sentiment_analyzer()
+        if request.get('full', False):
+            return [models['sia'].polarity_scores(text) for text in request['texts']]
+        if request.get('engine', 'batch') == 'nltk':
+            return [models['sia'].polarity_scores(text)['compound'] for text in request['texts']]
+
+        if 'batch_sia' not in models:
+            from batch_vader import BatchSentimentAnalyzer
+            models['batch_sia'] = BatchSentimentAnalyzer(models['sia'])
+        return models['batch_sia'].compound_scores(request['texts']).tolist()
+
+    elif op == 'tokenize':
+        options = dict(request.get('options', {}))
+        lowercase = options.pop('lowercase', True)
+        tokenizer = get_tokenizer(models, **options)
+        return [tokenizer.tokenize(text.lower() if lowercase else text) for text in request['texts']]
+
+    elif op == 'ping':
+        return 'pong'
+
+    raise ValueError(f'unknown operation: {op}')
+
+
+class ScoringRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Read requests from a client connection (one JSON object per line) and write one JSON response line for each.
+    Requests from different connections are handled one at a time because the models aren't thread-safe.
+    """
+    def handle(self):
+        for line in self.rfile:
+            try:
+                with self.server.lock:
+                    response = {'result': handle_request(self.server.models, json.loads(line))}
+            except Exception as e:
+                response = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+class ScoringServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Unix socket server that loads the models once at startup and keeps them in memory.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_file=utils.scoring_socket_file, verbose=True):
+        """
+        :param socket_file: path of the Unix socket file
+        :param verbose: if True, print some status messages
+        """
+        # remove a leftover socket file from a server that didn't shut down cleanly
+        if os.path.exists(socket_file):
+            if server_running(socket_file):
+                raise RuntimeError(f'A scoring server is already running at {socket_file}')
+            os.remove(socket_file)
+
+        if verbose:
+            print('Loading models.', flush=True)
+        self.models = {}
+        self.lock = threading.Lock()
+
+        # score and tokenize something so the lexicon, WordNet, and the POS tagger are loaded before the first request
+        for engine in ['nltk', 'batch']:
+            handle_request(self.models, {'op': 'sentiment', 'texts': ['These wings are great!'], 'engine': engine})
+        handle_request(self.models, {'op': 'tokenize', 'texts': ['She was eating the hottest wings.']})
+
+        super().__init__(socket_file, ScoringRequestHandler)
+        self.socket_file = socket_file
+
+        if verbose:
+            print(f'Listening on {socket_file}', flush=True)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_file):
+            os.remove(self.socket_file)
+
+
+class ScoringClient:
+    """
+    Client for sending requests to a running scoring server.
+    """
+    def __init__(self, socket_file=utils.scoring_socket_file, timeout=None):
+        """
+        :param socket_file: path of the Unix socket file
+        :param timeout: socket timeout in seconds (None to wait as long as it takes)
+        """
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        self.sock.connect(socket_file)
+        self.file = self.sock.makefile('rwb')
+
+    def request(self, request):
+        """
+        Send a request to the server and return the result.
+        """
+        self.file.write((json.dumps(request) + '\n').encode())
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ConnectionError('Scoring server closed the connection')
+
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(f"Scoring server error -- {response['error']}")
+
+        return response['result']
+
+    def sentiment_scores(self, texts, full=False, engine='batch'):
+        return self.request({'op': 'sentiment', 'texts': list(texts), 'full': full, 'engine': engine})
+
+    def tokenize(self, texts, **options):
+        return self.request({'op': 'tokenize', 'texts': list(texts), 'options': options})
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def server_running(socket_file=utils.scoring_socket_file):
+    """
+    Check if a scoring server is running and accepting connections.
+    """
+    if not os.path.exists(socket_file):
+        return False
+
+    try:
+        with ScoringClient(socket_file, timeout=5) as client:
+            return client.request({'op': 'ping'}) == 'pong'
+    except (OSError, ValueError):
+        return False
+
+
+def run_request(request, socket_file=utils.scoring_socket_file, batch_size=5000):
+    """
+    Send a request to the scoring server if it's running; otherwise process it in this process (loading the models the
+    first time). Long lists of texts are sent in batches to keep the messages a reasonable size.
+
+    :param request: request dictionary (see handle_request)
+    :param socket_file: path of the Unix socket file
+    :param batch_size: maximum number of texts per request to the server
+    :return: result of the request
+    """
+    if server_running(socket_file):
+        with ScoringClient(socket_file) as client:
+            if 'texts' not in request:
+                return client.request(request)
+
+            texts = list(request['texts'])
+            result = []
+            for start in range(0, len(texts), batch_size):
+                result += client.request(dict(request, texts=texts[start:start + batch_size]))
+            return result
+
+    return handle_request(local_models, request)
+
+
+def sentiment_scores(texts, full=False, engine='batch', socket_file=utils.scoring_socket_file):
+    """
+    Compute the VADER sentiment score of each text, using the scoring server if it's running.
+
+    :param texts: list of strings
+    :param full: if True, return the full polarity_scores dictionary for each text instead of the compound score
+    :param engine: 'batch' to use BatchSentimentAnalyzer or 'nltk' to use nltk's SentimentIntensityAnalyzer
+    :param socket_file: path of the Unix socket file
+    :return: list of compound scores (or dictionaries if full is True)
+    """
+    return run_request({'op': 'sentiment', 'texts': texts, 'full': full, 'engine': engine}, socket_file=socket_file)
+
+
+def tokenize(texts, socket_file=utils.scoring_socket_file, **options):
+    """
+    Tokenize each text with MyTokenizer, using the scoring server if it's running.
+
+    :param texts: list of strings
+    :param socket_file: path of the Unix socket file
+    :param options: tokenizer options (see handle_request)
+    :return: list of token lists
+    """
+    return run_request({'op': 'tokenize', 'texts': texts, 'options': options}, socket_file=socket_file)
+
+
+if __name__ == '__main__':
+    server = ScoringServer()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('\nShutting down.')
+    finally:
+        server.server_close()
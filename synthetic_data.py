@@ -0,0 +1,189 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+
+# a handful of real words so the tokenizer, pronoun replacement, and sentiment code paths have something to work on
+common_words = ['the', 'i', 'to', 'and', 'a', 'is', 'of', 'this', 'he', 'she', 'so', 'that', 'it', 'in', 'was',
+                'you', 'her', 'his', 'love', 'funny', 'hot', 'sauce', 'wings', 'sean', 'lol', 'not', 'but', 'very',
+                'great', 'episode', 'best', 'guest', 'him', 'like', 'bad', 'good', 'really', "she's", "he's", 'hate',
+                'amazing', 'awesome', 'annoying', 'cute', 'beautiful', 'smart', '!', '?', '.', ',', '😂', '🔥']
+
+first_names = ['alex', 'jordan', 'taylor', 'morgan', 'casey', 'riley', 'jamie', 'avery', 'quinn', 'rowan', 'sage',
+               'drew', 'blake', 'reese', 'emery', 'kendall', 'logan', 'parker', 'skyler', 'dakota']
+last_names = ['smith', 'garcia', 'nguyen', 'okafor', 'kowalski', 'haddad', 'silva', 'tanaka', 'muller', 'rossi',
+              'novak', 'fischer', 'petrov', 'larsen', 'moreau', 'kaur', 'cohen', 'reyes', 'walsh', 'ibrahim']
+
+
+def make_vocabulary(size, seed=0):
+    """
+    Build a deterministic vocabulary of made-up words. The most frequent entries are real words (see common_words) and
+    the rest are random syllable combinations.
+
+    :param size: number of words in the vocabulary
+    :param seed: random seed
+    :return: list of words, ordered from most to least frequent rank
+    """
+    rng = np.random.RandomState(seed)
+    syllables = [c + v for c in 'bdfghklmnprstvwz' for v in 'aeiou']
+
+    vocab = list(common_words[:size])
+    seen = set(vocab)
+    while len(vocab) < size:
+        n_syllables = rng.randint(1, 5)
+        word = ''.join(syllables[j] for j in rng.randint(0, len(syllables), n_syllables))
+        if word not in seen:
+            seen.add(word)
+            vocab.append(word)
+
+    return vocab
+
+
+def zipf_probabilities(size, exponent=1.1):
+    """
+    Probabilities for a bounded Zipf distribution: the word with rank r has probability proportional to 1 / r^exponent.
+    """
+    weights = 1 / np.arange(1, size + 1) ** exponent
+    return weights / weights.sum()
+
+
+def generate_guest_list(n_guests, female_share=0.25, seed=0):
+    """
+    Create a guest list dataframe with the columns used by the analysis scripts.
+
+    :param n_guests: number of guests (one video per guest)
+    :param female_share: fraction of guests with female_flag = 1
+    :param seed: random seed
+    :return: pandas dataframe in the same format as the guest list CSV file
+    """
+    rng = np.random.RandomState(seed)
+    rows = []
+    for i in range(n_guests):
+        first = first_names[rng.randint(len(first_names))]
+        last = last_names[rng.randint(len(last_names))]
+        rows.append({
+            'season': i // 12 + 1,
+            'episode': i % 12 + 1,
+            'overall': i + 1,
+            'guest': f'{first.title()} {last.title()}',
+            'female_flag': int(rng.rand() < female_share),
+            'video_id': f'synth{i:06d}',
+            'done': 1,
+            'name_filter': f'{first}, {last}',
+        })
+
+    return pd.DataFrame(rows)
+
+
+def generate_comments(n_comments, vocab, probabilities, names=(), name_rate=0.05, mean_length=12, seed=0,
+                      id_prefix='c'):
+    """
+    Generate synthetic comments in the same format as the scraped comment JSON files. Comment lengths are geometric and
+    words are drawn from the (Zipfian) word probabilities. A fraction of comments mention the guest by name, sometimes
+    with punctuation or a possessive attached so the name scrubbing code has some work to do.
+
+    :param n_comments: number of comments to generate
+    :param vocab: list of words (see make_vocabulary)
+    :param probabilities: probability of each word in vocab (see zipf_probabilities)
+    :param names: names that can be mentioned in the comments
+    :param name_rate: fraction of comments that mention one of the names
+    :param mean_length: average number of words per comment
+    :param seed: random seed
+    :param id_prefix: prefix for the comment IDs
+    :return: list of comment dictionaries
+    """
+    rng = np.random.RandomState(seed)
+    lengths = rng.geometric(1 / mean_length, n_comments)
+    word_ids = rng.choice(len(vocab), size=lengths.sum(), p=probabilities)
+    breaks = np.cumsum(lengths)[:-1]
+    mentions = rng.rand(n_comments) < name_rate if len(names) > 0 else np.zeros(n_comments, dtype=bool)
+    likes = rng.geometric(0.3, n_comments) - 1
+    name_suffixes = ['', '', "'s", '!', ',', '?']
+
+    comments = []
+    for i, ids in enumerate(np.split(word_ids, breaks)):
+        words = [vocab[j] for j in ids]
+        if mentions[i]:
+            name = names[rng.randint(len(names))] + name_suffixes[rng.randint(len(name_suffixes))]
+            words.insert(rng.randint(len(words) + 1), name)
+        comments.append({
+            'id': f'{id_prefix}{i:08d}',
+            'author': f'user{rng.randint(10 ** 6)}',
+            'commentText': ' '.join(words),
+            'likes': int(likes[i]),
+            'hasReplies': False,
+        })
+
+    return comments
+
+
+def write_comment_file(comment_batches, file):
+    """
+    Write comments as a JSON array, one batch at a time so huge videos never need to be held in memory at once.
+
+    :param comment_batches: iterable of lists of comment dictionaries
+    :param file: output file path
+    """
+    with open(file, 'w') as f:
+        f.write('[')
+        first = True
+        for comments in comment_batches:
+            for comment in comments:
+                if not first:
+                    f.write(',\n')
+                json.dump(comment, f)
+                first = False
+        f.write(']')
+
+
+def generate_corpus(out_dir, n_comments, n_guests=100, vocab_size=50000, zipf_exponent=1.1, name_rate=0.05,
+                    batch_size=100000, seed=0):
+    """
+    Write a synthetic corpus to disk: a guest list CSV file and a comments-{video_id}.json file for each guest. The
+    output only depends on the arguments, so the same corpus can be regenerated on any machine. Comments are
+    generated in batches, so corpora with tens of millions of comments can be written without holding them all in
+    memory.
+
+    :param out_dir: directory for the guest list file and comment files
+    :param n_comments: total number of comments across all videos
+    :param n_guests: number of guests/videos
+    :param vocab_size: number of distinct words
+    :param zipf_exponent: exponent of the Zipf distribution used for word frequencies
+    :param name_rate: fraction of comments that mention the guest by name
+    :param batch_size: maximum number of comments generated at once
+    :param seed: random seed
+    :return: guest list dataframe (also written to out_dir/guest_list.csv)
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.RandomState(seed)
+    guest_df = generate_guest_list(n_guests, seed=seed)
+    vocab = make_vocabulary(vocab_size, seed=seed)
+    probabilities = zipf_probabilities(vocab_size, zipf_exponent)
+
+    # popular guests get a lot more comments than the others
+    comment_counts = rng.multinomial(n_comments, rng.dirichlet(np.ones(n_guests) * 0.5))
+
+    for i, row in guest_df.iterrows():
+        names = [row['guest'].lower()] + row['name_filter'].split(', ')
+        batches = (generate_comments(min(batch_size, comment_counts[i] - start), vocab, probabilities, names=names,
+                                     name_rate=name_rate, seed=seed * 100003 + i * 1009 + start // batch_size,
+                                     id_prefix=f"{row['video_id']}-{start // batch_size}-")
+                   for start in range(0, comment_counts[i], batch_size))
+        write_comment_file(batches, os.path.join(out_dir, f"comments-{row['video_id']}.json"))
+        guest_df.loc[i, 'n_comments'] = comment_counts[i]
+
+    guest_df.to_csv(os.path.join(out_dir, 'guest_list.csv'), index=False)
+
+    return guest_df
+
+
+def iter_corpus_text(out_dir, guest_df):
+    """
+    Read the comment text of a synthetic corpus one video at a time, so only one video's comments are in memory.
+
+    :return: generator of (guest list row, list of comment strings) for each video, in the order of guest_df
+    """
+    for _, row in guest_df.iterrows():
+        comments = json.load(open(os.path.join(out_dir, f"comments-{row['video_id']}.json"), 'r'))
+        yield row, [comment['commentText'] for comment in comments if 'commentText' in comment]
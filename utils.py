@@ -6,7 +6,16 @@ import string
 # define some file and directory names
 guest_list_file = './guest_list.csv'
 comment_dir = './comments'
+score_dir = './scores'
 data_dir = './data'
+benchmark_dir = './benchmarks'
+scoring_socket_file = './scoring_server.sock'
+index_dir = './comment_index'
+sweep_cache_dir = './sweep_cache'
+analysis_cube_file = os.path.join(data_dir, 'analysis_cube.npz')
+near_duplicate_file = os.path.join(comment_dir, 'near_duplicate_clusters.csv')
+perspective_queue_file = os.path.join(comment_dir, 'perspective_queue.db')
+perspective_chunk_dir = os.path.join(comment_dir, 'perspective_chunks')
 youtube_api_key_file = './youtube_api_key.txt'
 perspective_api_key_file = './perspective_api_key.txt'
 perspective_api_key_file_2 = './perspective_api_key_2.txt'
@@ -86,6 +95,34 @@ def remove_duplicate_files(comment_dir=comment_dir):
                   os.path.join(comment_dir, file.split(' (')[0] + file.split(')')[-1]))
 
 
+def get_name_variants(row):
+    """
+    Get the set of tokens that count as a mention of a guest's name: the guest's full name (lowercase), the tokens in
+    the 'name_filter' column of the guest list CSV file, and those tokens with some basic punctuation attached.
+
+    :param row: row of the guest dataframe (must have 'guest' and 'name_filter' entries)
+    :return: set of lowercase name tokens
+    """
+    raw_names = [row['guest'].lower()] + row['name_filter'].split(', ')
+    names = raw_names + [x + "'s" for x in raw_names]
+    names += [x + y for y in string.punctuation for x in raw_names]
+    names += [y + x for y in string.punctuation for x in raw_names]
+
+    return set(names)
+
+
+def scrub_text(text, names, name_token='<name>'):
+    """
+    Replace each space-separated token in a string that matches one of the names (ignoring case) with name_token.
+
+    :param text: string to scrub
+    :param names: set of lowercase name tokens (see get_name_variants)
+    :param name_token: token to replace the names with
+    :return: scrubbed string
+    """
+    return ' '.join([name_token if x.lower() in names else x for x in text.split(' ')])
+
+
 def scrub_names(df, comments_col='comments', name_token='<name>'):
     """
     For each guest, replace the guest's name with a generic '<name>' token. Tokens to replace for each guest are
@@ -99,16 +136,7 @@ def scrub_names(df, comments_col='comments', name_token='<name>'):
 
     for i, row in df.iterrows():
         # look for tokens specified in CSV, plus those tokens including some basic punctuation
-        raw_names = [row['guest'].lower()] + row['name_filter'].split(', ')
-        names = raw_names + [x + "'s" for x in raw_names]
-        names += [x + y for y in string.punctuation for x in raw_names]
-        names += [y + x for y in string.punctuation for x in raw_names]
-
-        comments = row[comments_col]
-        scrubbed_comments = comments.split(' ')
-        scrubbed_comments = [name_token if x.lower() in names else x for x in scrubbed_comments]
-        scrubbed_comments = ' '.join(scrubbed_comments)
-
-        df.loc[i, comments_col] = scrubbed_comments
+        names = get_name_variants(row)
+        df.loc[i, comments_col] = scrub_text(row[comments_col], names, name_token)
 
     return df